@@ -0,0 +1,134 @@
+"""discord.py cache memory per runtime profile: per 10k members and per 100k messages.
+
+Usage: python bench/cache_memory.py [--members 10000] [--messages 100000] [--voice-pct 1]
+
+Builds a real discord.py ConnectionState for each profile (the same kwargs
+main.client_options() gives the client) and feeds it synthetic gateway
+payloads through the normal parsers:
+
+  members   one GUILD_CREATE carrying N members, voice-pct% of them in voice
+            (what a chunked guild leaves in the member cache)
+  messages  M MESSAGE_CREATE events with member authors, as on_message sees them
+
+Reports tracemalloc bytes still held after each step. No network needed.
+Profiles: default (current intents), members (default + members intent, as
+many large bots run) and lean.
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import pathlib
+import sys
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("MODEL_BACKEND", "fake")
+os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="disha-bench-cache-"))
+os.environ.setdefault("MEMORY_DB", os.path.join(tempfile.mkdtemp(prefix="disha-bench-mem-"), "memory.db"))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import discord  # noqa: E402
+
+import main  # noqa: E402
+
+GUILD_ID = 1_000_000_000_000_000_001
+TEXT_ID = GUILD_ID + 1
+VOICE_ID = GUILD_ID + 2
+USER_BASE = 2_000_000_000_000_000_000
+
+
+def profiles():
+    members = main.client_options("default")
+    members["intents"].members = True
+    return {
+        "default": main.client_options("default"),
+        "members": members,
+        "lean": main.client_options("lean"),
+    }
+
+
+def user_payload(i: int) -> dict:
+    return {"id": str(USER_BASE + i), "username": f"user{i}", "global_name": f"User {i}",
+            "discriminator": "0", "avatar": None}
+
+
+def member_payload(i: int) -> dict:
+    return {"user": user_payload(i), "roles": [], "nick": None, "deaf": False, "mute": False,
+            "joined_at": "2024-01-01T00:00:00+00:00", "flags": 0}
+
+
+def guild_payload(n_members: int, voice_pct: float) -> dict:
+    in_voice = max(1, int(n_members * voice_pct / 100))
+    return {
+        "id": str(GUILD_ID), "name": "bench", "owner_id": str(USER_BASE), "large": True,
+        "member_count": n_members, "features": [], "emojis": [], "stickers": [],
+        "roles": [{"id": str(GUILD_ID), "name": "@everyone", "permissions": "0", "position": 0,
+                   "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [
+            {"id": str(TEXT_ID), "type": 0, "name": "chat", "position": 0, "permission_overwrites": []},
+            {"id": str(VOICE_ID), "type": 2, "name": "vc", "position": 1, "permission_overwrites": [],
+             "bitrate": 64000, "user_limit": 0},
+        ],
+        "members": [member_payload(i) for i in range(n_members)],
+        "voice_states": [
+            {"user_id": str(USER_BASE + i), "channel_id": str(VOICE_ID), "session_id": f"s{i}",
+             "deaf": False, "mute": False, "self_deaf": False, "self_mute": False,
+             "self_video": False, "suppress": False}
+            for i in range(in_voice)
+        ],
+        "threads": [], "stage_instances": [], "guild_scheduled_events": [],
+    }
+
+
+def message_payload(i: int, n_members: int) -> dict:
+    author = i % max(1, n_members)
+    return {
+        "id": str(discord.utils.time_snowflake(discord.utils.utcnow()) + i),
+        "channel_id": str(TEXT_ID), "guild_id": str(GUILD_ID), "type": 0,
+        "content": f"message number {i} from a fairly ordinary chat line",
+        "author": user_payload(author), "member": {k: v for k, v in member_payload(author).items() if k != "user"},
+        "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False,
+        "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+        "embeds": [], "pinned": False, "flags": 0,
+    }
+
+
+def held() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+async def measure(name: str, options: dict, n_members: int, n_messages: int, voice_pct: float):
+    client = discord.Client(**options)
+    state = client._connection
+    base = held()
+    guild_data = guild_payload(n_members, voice_pct)
+    state._add_guild_from_data(guild_data)
+    del guild_data
+    after_guild = held()
+    for i in range(n_messages):
+        state.parse_message_create(message_payload(i, n_members))
+    after_messages = held()
+    guild = state._get_guild(GUILD_ID)
+    cached = len(state._messages) if state._messages is not None else 0
+    per_10k_members = (after_guild - base) * 10_000 / max(1, n_members)
+    per_100k_msgs = (after_messages - after_guild) * 100_000 / max(1, n_messages)
+    print(f"{name:<8} members cached {len(guild._members):>6}  messages cached {cached:>6}  "
+          f"{per_10k_members / 2**20:7.2f} MB/10k members  {per_100k_msgs / 2**20:7.2f} MB/100k messages")
+    await client.close()
+
+
+async def run(args):
+    tracemalloc.start()
+    for name, options in profiles().items():
+        await measure(name, options, args.members, args.messages, args.voice_pct)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--members", type=int, default=10_000)
+    ap.add_argument("--messages", type=int, default=100_000)
+    ap.add_argument("--voice-pct", type=float, default=1.0)
+    asyncio.run(run(ap.parse_args()))
@@ -0,0 +1,335 @@
+"""Offline load-replay harness for on_message.
+
+Drives main.on_message with fake Discord messages/channels/voice clients, the
+fake model backend and a fake TTS stream, so no Discord, Gemini or network
+is needed.
+
+Usage:
+  python bench/replay.py --users 50 --rate 20 --duration 30
+  python bench/replay.py --trace traffic.jsonl [--rate 20]
+
+Trace format, one JSON object per line (missing "t" -> paced at --rate):
+  {"t": 0.4, "user": 11, "channel": 5, "guild": 1, "content": "hi disha",
+   "mention": true, "reply_to_bot": false}
+"guild": null (or a missing "channel") means a DM.
+
+Reports throughput, p50/p95/p99 reply latency (message -> text reply sent),
+skipped-message counts by reason and peak memory.
+
+The fake model has no API quota, so MODEL_RPM defaults to unthrottled here;
+set MODEL_RPM=60 to see how a real key's quota shapes latency.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("MODEL_BACKEND", "fake")
+os.environ.setdefault("MODEL_RPM", "1000000")
+os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="disha-replay-tts-"))
+# Never write synthetic conversations into the real memory DB
+os.environ.setdefault("MEMORY_DB", os.path.join(tempfile.mkdtemp(prefix="disha-replay-mem-"), "memory.db"))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import discord  # noqa: E402
+
+import main  # noqa: E402
+
+# =============================
+# Fake Discord objects
+# =============================
+class FakeUser:
+    def __init__(self, uid: int, name: str, bot: bool = False):
+        self.id = uid
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{uid}>"
+        self.voice = None
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class _ChannelMixin:
+    def _setup(self, cid: int, harness):
+        self.id = cid
+        self.harness = harness
+
+    def typing(self):
+        return _Typing()
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.harness.send_latency)
+        self.harness.on_send(self, content or "")
+        return None
+
+class FakeTextChannel(_ChannelMixin):
+    def __init__(self, cid: int, guild, harness):
+        self._setup(cid, harness)
+        self.guild = guild
+
+class FakeDMChannel(_ChannelMixin, discord.DMChannel):
+    def __init__(self, cid: int, harness):
+        self._setup(cid, harness)
+
+class FakeGuild:
+    def __init__(self, gid: int):
+        self.id = gid
+
+class FakeReference:
+    def __init__(self, resolved):
+        self.resolved = resolved
+        self.message_id = getattr(resolved, "id", None)
+
+class FakeMessage:
+    def __init__(self, mid, author, channel, guild, content, mentions=(), reference=None):
+        self.id = mid
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.content = content
+        self.mentions = list(mentions)
+        self.reference = reference
+
+class FakeSource:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def cleanup(self):
+        pass
+
+class FakeVoiceClient:
+    """Plays every clip for a fixed duration and reports completion via after=."""
+
+    def __init__(self, harness):
+        self.harness = harness
+        self._playing = False
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self._playing
+
+    def stop(self):
+        self._playing = False
+
+    def play(self, source, after=None):
+        self._playing = True
+        self.harness.clips += 1
+
+        def done():
+            self._playing = False
+            if after:
+                after(None)
+
+        asyncio.get_running_loop().call_later(self.harness.play_secs, done)
+
+# =============================
+# Harness
+# =============================
+class Harness:
+    def __init__(self, args):
+        self.send_latency = args.send_ms / 1000
+        self.play_secs = args.play_ms / 1000
+        self.tts_secs = args.tts_ms / 1000
+        self.bot = FakeUser(1, "Disha", bot=True)
+        self.users = {}
+        self.guilds = {}
+        self.channels = {}
+        self.voice = {}
+        self.pending = {}   # (channel_id, user_id) -> [arrival times not yet answered]
+        self.latencies = []
+        self.replies = 0
+        self.clips = 0
+        self.sent_messages = 0
+        self._next_id = discord.utils.time_snowflake(discord.utils.utcnow())
+        self.with_voice = args.voice
+
+    def install(self):
+        main.client._connection.user = self.bot
+        main.get_voice_client = lambda guild: self.voice.get(guild.id) if guild else None
+        discord.FFmpegPCMAudio = discord.FFmpegOpusAudio = FakeSource
+
+        tts_secs = self.tts_secs
+
+        async def fake_stream(ssml):
+            for _ in range(4):
+                await asyncio.sleep(tts_secs / 4)
+                yield b"\xff" * 2048
+
+        async def fake_transcode(src, dst, input_opts=""):
+            with open(src, "rb") as f, open(dst, "wb") as out:
+                out.write(f.read())
+
+        for backend in main.tts_backends.values():
+            backend._stream = fake_stream
+        main._transcode_opus = fake_transcode
+
+    def user(self, uid: int) -> FakeUser:
+        if uid not in self.users:
+            self.users[uid] = FakeUser(uid, f"user{uid}")
+        return self.users[uid]
+
+    def channel(self, cid, gid):
+        key = (cid, gid)
+        ch = self.channels.get(key)
+        if ch is None:
+            if gid is None:
+                ch = FakeDMChannel(cid, self)
+            else:
+                guild = self.guilds.setdefault(gid, FakeGuild(gid))
+                ch = FakeTextChannel(cid, guild, self)
+                if self.with_voice and gid not in self.voice:
+                    self.voice[gid] = FakeVoiceClient(self)
+            self.channels[key] = ch
+        return ch
+
+    def make_message(self, ev: dict) -> FakeMessage:
+        self._next_id += 1 << 22  # +1 ms per message keeps snowflakes ordered
+        gid = ev.get("guild")
+        cid = ev.get("channel")
+        if cid is None:
+            gid = None
+            cid = 10_000_000 + ev["user"]
+        ch = self.channel(cid, gid)
+        author = self.user(ev["user"])
+        mentions = [self.bot] if ev.get("mention") else []
+        ref = None
+        if ev.get("reply_to_bot"):
+            ref = FakeReference(FakeMessage(self._next_id - 1, self.bot, ch, ch.guild if gid else None, "..."))
+        content = ev.get("content", "")
+        if ev.get("mention"):
+            content = f"{self.bot.mention} {content}"
+        return FakeMessage(self._next_id, author, ch, getattr(ch, "guild", None) if gid else None,
+                           content, mentions, ref)
+
+    def on_send(self, channel, content: str):
+        self.sent_messages += 1
+        now = time.perf_counter()
+        for uid, user in self.users.items():
+            if content.startswith(user.mention):
+                waiting = self.pending.get((channel.id, uid))
+                if waiting:
+                    # A reply answers everything that user said before it
+                    self.latencies.append(now - waiting[-1])
+                    waiting.clear()
+                    self.replies += 1
+                return
+
+    async def dispatch(self, ev: dict):
+        msg = self.make_message(ev)
+        self.pending.setdefault((msg.channel.id, msg.author.id), []).append(time.perf_counter())
+        await main.on_message(msg)
+
+# =============================
+# Traffic
+# =============================
+SMALL_TALK = ["hi disha", "kya kar rahi ho", "gn", "mera din bahut bekaar tha", "acha sunao",
+              "aaj kya scene hai", "lol", "haan yaar", "thoda bore ho raha hoon", "kuch gaana suggest karo"]
+
+def synthetic(args):
+    rng = random.Random(args.seed)
+    n = int(args.rate * args.duration)
+    events = []
+    for i in range(n):
+        uid = 100 + rng.randrange(args.users)
+        dm = rng.random() < args.dm_ratio
+        ev = {
+            "t": i / args.rate,
+            "user": uid,
+            "content": rng.choice(SMALL_TALK),
+            "mention": (not dm) and rng.random() < 0.6,
+        }
+        if not dm:
+            ev["guild"] = 1 + uid % args.guilds
+            ev["channel"] = 1000 + uid % args.guilds
+            ev["reply_to_bot"] = not ev["mention"] and rng.random() < 0.3
+        events.append(ev)
+    return events
+
+def load_trace(path: str, rate: float):
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            ev = json.loads(line)
+            ev.setdefault("t", i / rate)
+            ev.setdefault("user", 100 + i % 50)
+            ev.setdefault("content", ev.get("title") or ev.get("body") or "hi")
+            events.append(ev)
+    return events
+
+def pct(xs, q):
+    if not xs:
+        return float("nan")
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+async def run(args):
+    events = load_trace(args.trace, args.rate) if args.trace else synthetic(args)
+    h = Harness(args)
+    h.install()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tasks = []
+    for ev in events:
+        delay = start + ev["t"] - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(h.dispatch(ev)))
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(args.drain)  # coalesced bursts, queued speech
+    while main.admission.running or main.admission.depth():
+        await asyncio.sleep(0.1)  # replies still waiting for / holding a slot
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    lat = [x * 1000 for x in h.latencies]
+    print(f"messages      {len(events)} in {elapsed:.1f}s")
+    print(f"replies       {h.replies}  ({h.replies / elapsed:.1f}/s), sends {h.sent_messages}, voice clips {h.clips}")
+    print(f"latency ms    p50={pct(lat, .5):.0f}  p95={pct(lat, .95):.0f}  p99={pct(lat, .99):.0f}")
+    print(f"skipped       {dict(main.C_SKIPPED.values)}")
+    print(f"shed          {dict(main.C_SHED.values)}")
+    print(f"reply cache   {dict(main.C_REPLY_CACHE.values)}")
+    print(f"memory        tracemalloc peak {peak / 1e6:.1f} MB, max RSS {rss_mb:.1f} MB")
+    print(f"users         {main.users.report()}")
+    print(f"model         {main.model_client.report()}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trace", help="JSONL traffic file; default is synthetic traffic")
+    ap.add_argument("--rate", type=float, default=20.0, help="messages/sec")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds of synthetic traffic")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--guilds", type=int, default=3)
+    ap.add_argument("--dm-ratio", type=float, default=0.2)
+    ap.add_argument("--voice", action="store_true", help="bot is in a VC in every guild")
+    ap.add_argument("--send-ms", type=float, default=60.0, help="fake Discord send latency")
+    ap.add_argument("--tts-ms", type=float, default=300.0, help="fake TTS synthesis time")
+    ap.add_argument("--play-ms", type=float, default=2500.0, help="fake playback length per clip")
+    ap.add_argument("--drain", type=float, default=5.0, help="seconds to wait after the last message")
+    ap.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(ap.parse_args()))
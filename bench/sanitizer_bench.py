@@ -0,0 +1,145 @@
+"""Microbenchmark: reply sanitizers vs. the original multi-pass regex versions.
+
+Usage: python bench/sanitizer_bench.py [--n 2000] [--repeat 5] [--seed 7]
+
+Runs clamp_human, get_speakable_text and improve_hinglish over a synthetic
+reply corpus, checks the output is identical to the reference versions kept
+below, and prints per-call timings.
+"""
+
+import argparse
+import pathlib
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+# ---- Reference (pre-optimization) implementations, kept verbatim ----
+
+def ref_clamp_human(text: str) -> str:
+    if not text:
+        return "Main yahin hoon—batao na, mood kaisa chal raha hai. "
+    text = main.SPACE_FIX.sub("\n", text).strip()
+    text = main.MULTISPACE.sub(" ", text)
+    text = re.sub(r"[*_#>`~|-]+", "", text)
+    emojis = re.findall(r"[\U0001F300-\U0001FAFF☀-⛿]", text)
+    if len(emojis) > 1:
+        first = emojis[0]
+        text = re.sub(r"[\U0001F300-\U0001FAFF☀-⛿]", "", text).strip()
+        text = (text + " " + first).strip()
+    parts = re.split(r"(?<=[.!?])\s+", text)
+    parts = [p.strip() for p in parts if p.strip()]
+    if not parts:
+        parts = [text.strip()]
+    out = " ".join(parts[:2])
+    if len(out) > 330:
+        out = out[:320].rstrip() + "…"
+    return out.strip()
+
+
+def ref_strip_mentions_links_code(s: str) -> str:
+    s = main.CODE_FENCE_RE.sub("\n", s)
+    s = main.INLINE_CODE_RE.sub(" ", s)
+    s = main.URL_RE.sub(" ", s)
+    s = main.MD_LINK_RE.sub(r"\1", s)
+    for rx in (main.MENTION_TAG_RE, main.ROLE_TAG_RE, main.CHANNEL_TAG_RE,
+               main.TIMESTAMP_TAG_RE, main.CUSTOM_EMOJI_RE):
+        s = rx.sub(" ", s)
+    s = main.UNICODE_EMOJI_RE.sub(" ", s)
+    s = re.sub(r"[*_~`|>]+", " ", s)
+    s = re.sub(r"[^\S\r\n]+", " ", s)
+    return s.strip()
+
+
+def ref_improve_hinglish(text: str) -> str:
+    def repl(m):
+        w = m.group(0)
+        fixed = main.HINGLISH_MAP.get(w.lower())
+        if fixed and w[0].isupper():
+            return fixed
+        return fixed or w
+    return re.sub(r"\b[a-zA-Z]+\b", repl, text)
+
+
+def ref_get_speakable_text(text: str) -> str:
+    original = text or ""
+    if "```" in original or re.search(r"(?i)\b(render\.yaml|dockerfile|services:|envVars:|FROM |WORKDIR |CMD )", original):
+        return main.CODE_SUMMARY_LINE
+    s = ref_strip_mentions_links_code(original)
+    yaml_lines = main.YAML_KEYLINE_RE.findall(s)
+    s = main.YAML_KEYLINE_RE.sub(" ", s)
+    s = re.sub(r"\s+", " ", s).strip()
+    sym_ratio = (sum(c in "{}[]:/\\=;|@" for c in s) / max(1, len(s))) if s else 1.0
+    if (not s) or sym_ratio > 0.08 or bool(yaml_lines):
+        return main.CODE_SUMMARY_LINE
+    s = ref_improve_hinglish(s)
+    if len(s) > 260:
+        s = s[:250].rsplit(" ", 1)[0] + "…"
+    return s
+
+# ---- Corpus ----
+
+WORDS = ("acha yaar kya scene hai bahut mast thoda tum mera dil khush Booyah KYA "
+         "hello sun rahi hoon vibe chill kar lo aaj ka din kaisa tha kyaa yaar2 "
+         "café naïve").split()
+DECOR = ["🙂", "✨", "😄", "☀", "**bold**", "_it_", "`code`", "~~x~~", "> quote", "|", "-", "#tag",
+         "<@123>", "<@!45>", "<@&9>", "<#77>", "<t:1700000000:R>", "<:wave:123>", "<a:dance:456>",
+         "https://example.com/x?y=1", "[link](https://a.b)", "key: value", "\n", " \n", "\t",
+         "  ", "\u00a0", "\u2028", "\x1c", "\r\n", "!", "?", ".", "...", "{x}", "a=b;", "```py\nx=1\n```", "services:", "Dockerfile"]
+
+
+def make_corpus(n: int, seed: int):
+    rng = random.Random(seed)
+    corpus = [c.REPLIES[i] for c in (main.FakeChat,) for i in range(len(c.REPLIES))]
+    corpus += [main.CODE_SUMMARY_LINE, ""]
+    while len(corpus) < n:
+        parts = []
+        for _ in range(rng.randint(3, 40)):
+            parts.append(rng.choice(DECOR) if rng.random() < 0.25 else rng.choice(WORDS))
+            parts.append(rng.choice([" ", " ", " ", ". ", "! ", "? ", "\n", ""]))
+        corpus.append("".join(parts))
+    return corpus
+
+
+def bench(ref, new, corpus, repeat):
+    """Best-of-N µs per call for (ref, new), alternating runs to even out noise."""
+    best = [float("inf"), float("inf")]
+    for _ in range(repeat):
+        for i, fn in enumerate((ref, new)):
+            t0 = time.perf_counter()
+            for text in corpus:
+                fn(text)
+            best[i] = min(best[i], time.perf_counter() - t0)
+    return [b / len(corpus) * 1e6 for b in best]
+
+
+def main_(args):
+    corpus = make_corpus(args.n, args.seed)
+    pairs = [
+        ("clamp_human", ref_clamp_human, main.clamp_human),
+        ("strip_mentions_links_code", ref_strip_mentions_links_code, main.strip_mentions_links_code),
+        ("improve_hinglish", ref_improve_hinglish, main.improve_hinglish),
+        ("get_speakable_text", ref_get_speakable_text, main.get_speakable_text),
+    ]
+    ok = True
+    for name, ref, new in pairs:
+        bad = [t for t in corpus if ref(t) != new(t)]
+        if bad:
+            ok = False
+            print(f"MISMATCH {name}: {len(bad)} inputs, first: {bad[0]!r}")
+        old_us, new_us = bench(ref, new, corpus, args.repeat)
+        print(f"{name:<27} ref {old_us:7.2f} µs  new {new_us:7.2f} µs  speedup x{old_us / new_us:4.2f}")
+    print(f"corpus={len(corpus)} identical={'yes' if ok else 'NO'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=7)
+    sys.exit(main_(ap.parse_args()))
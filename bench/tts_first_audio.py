@@ -0,0 +1,85 @@
+"""First-audio latency: file-based TTS vs streamed TTS, against a local fake TTS stream.
+
+Usage: python bench/tts_first_audio.py [--runs 20] [--chunks 24] [--chunk-ms 15] [--connect-ms 120]
+
+"First audio" is the moment the first MP3 bytes are readable by the FFmpeg
+source: after the full save for the file path, after the first chunk for the
+stream path. No network, Discord or FFmpeg needed.
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="disha-bench-tts-"))
+os.environ.setdefault("MEMORY_DB", os.path.join(tempfile.mkdtemp(prefix="disha-bench-mem-"), "memory.db"))
+os.environ.setdefault("VOICE_CODEC", "pcm")  # first audio only; no FFmpeg transcodes
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+def install_fake_tts(chunks: int, chunk_ms: float, connect_ms: float, chunk_bytes: int = 4096):
+    async def fake_stream(ssml: str):
+        await asyncio.sleep(connect_ms / 1000)
+        for _ in range(chunks):
+            await asyncio.sleep(chunk_ms / 1000)
+            yield b"\xff" * chunk_bytes
+
+    # synthesize() and stream() both read the backend's _stream()
+    main.tts_backends["edge"]._stream = fake_stream
+
+
+async def first_audio_file(ssml: str) -> float:
+    main.ENABLE_TTS_STREAM = False
+    t0 = time.perf_counter()
+    path = await main.open_tts_audio(ssml, main.tts_backends["edge"])
+    with open(path, "rb") as f:
+        f.read(8192)
+    return time.perf_counter() - t0
+
+
+async def first_audio_stream(ssml: str) -> float:
+    main.ENABLE_TTS_STREAM = True
+    t0 = time.perf_counter()
+    audio = await main.open_tts_audio(ssml, main.tts_backends["edge"])
+    if isinstance(audio, main.AudioChunkPipe):
+        # FFmpeg's stdin writer reads from a worker thread
+        await asyncio.to_thread(audio.read, 8192)
+    else:
+        with open(audio, "rb") as f:
+            f.read(8192)
+    return time.perf_counter() - t0
+
+
+def summary(name: str, xs):
+    xs = sorted(xs)
+    p95 = xs[min(len(xs) - 1, int(round(0.95 * (len(xs) - 1))))]
+    print(f"{name:<8} p50={statistics.median(xs) * 1000:7.1f} ms  p95={p95 * 1000:7.1f} ms  n={len(xs)}")
+
+
+async def run(args):
+    install_fake_tts(args.chunks, args.chunk_ms, args.connect_ms)
+    file_t, stream_t = [], []
+    for i in range(args.runs):
+        # Unique text per run so neither path is served from the cache
+        file_t.append(await first_audio_file(main.make_ssML(f"file run {i}", "")))
+        stream_t.append(await first_audio_stream(main.make_ssML(f"stream run {i}", "")))
+    await asyncio.sleep((args.connect_ms + args.chunks * args.chunk_ms) / 1000 + 0.05)  # let pumps finish
+    summary("file", file_t)
+    summary("stream", stream_t)
+    print("cache", main.tts_cache.stats())
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--chunks", type=int, default=24)
+    ap.add_argument("--chunk-ms", type=float, default=15.0)
+    ap.add_argument("--connect-ms", type=float, default=120.0)
+    asyncio.run(run(ap.parse_args()))
@@ -0,0 +1,131 @@
+"""CPU per spoken line: PCM path vs FFmpeg Opus vs pre-encoded Ogg Opus (codec copy).
+
+Usage: python bench/voice_cpu.py [--runs 10] [--seconds 6] [--mp3 clip.mp3]
+
+Each run drains an AudioSource the way discord.py's player does (read() every
+20 ms frame, here without the sleep) and counts CPU for this process plus the
+FFmpeg child (RUSAGE_SELF + RUSAGE_CHILDREN):
+
+  pcm        FFmpegPCMAudio + discord.opus.Encoder per frame (the old path)
+  opus       FFmpegOpusAudio: FFmpeg decodes the MP3 and encodes Opus itself
+  opus-copy  FFmpegOpusAudio(codec="copy") over the cached .opus clip
+
+Needs ffmpeg on PATH and libopus loadable by discord.py (for the pcm path).
+Without --mp3 a sine clip is generated with ffmpeg.
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+
+os.environ.setdefault("MODEL_BACKEND", "fake")
+os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="disha-bench-voice-cache-"))
+os.environ.setdefault("MEMORY_DB", os.path.join(tempfile.mkdtemp(prefix="disha-bench-mem-"), "memory.db"))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import discord  # noqa: E402
+from discord.opus import Encoder  # noqa: E402
+
+import main  # noqa: E402
+
+OPUS_BITRATE_KBPS = main.OPUS_BITRATE_KBPS
+
+
+def cpu_seconds() -> float:
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    c = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return s.ru_utime + s.ru_stime + c.ru_utime + c.ru_stime
+
+
+def make_mp3(path: str, seconds: float):
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-f", "lavfi",
+         "-i", f"sine=frequency=440:duration={seconds}", "-ac", "1", "-ar", "24000",
+         "-b:a", "48k", path],
+        check=True,
+    )
+
+
+def make_opus(src: str, dst: str):
+    # The transcode main runs once per fixed or repeated clip
+    asyncio.run(main._transcode_opus(src, dst))
+
+
+def drain(source: discord.AudioSource, encoder=None) -> int:
+    frames = 0
+    try:
+        while True:
+            data = source.read()
+            if not data:
+                break
+            if encoder is not None:
+                encoder.encode(data, Encoder.SAMPLES_PER_FRAME)
+            frames += 1
+    finally:
+        source.cleanup()  # waits for FFmpeg, so its CPU lands in RUSAGE_CHILDREN
+    return frames
+
+
+def run_pcm(mp3: str) -> int:
+    enc = Encoder(bitrate=OPUS_BITRATE_KBPS)
+    return drain(discord.FFmpegPCMAudio(mp3, options="-vn"), enc)
+
+
+def run_opus(mp3: str) -> int:
+    return drain(discord.FFmpegOpusAudio(mp3, bitrate=OPUS_BITRATE_KBPS, options="-vn"))
+
+
+def run_opus_copy(opus: str) -> int:
+    return drain(discord.FFmpegOpusAudio(opus, codec="copy"))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--seconds", type=float, default=6.0)
+    ap.add_argument("--mp3", default="")
+    args = ap.parse_args()
+
+    if not discord.opus.is_loaded():
+        try:
+            discord.opus._load_default()
+        except Exception:
+            pass
+    tmpdir = tempfile.mkdtemp(prefix="disha-bench-voice-")
+    mp3 = args.mp3 or os.path.join(tmpdir, "clip.mp3")
+    if not args.mp3:
+        make_mp3(mp3, args.seconds)
+    opus = os.path.join(tmpdir, "clip.opus")
+    make_opus(mp3, opus)
+
+    cases = [("opus", lambda: run_opus(mp3)), ("opus-copy", lambda: run_opus_copy(opus))]
+    if discord.opus.is_loaded():
+        cases.insert(0, ("pcm", lambda: run_pcm(mp3)))
+    else:
+        print("libopus not loadable: skipping the pcm path", file=sys.stderr)
+
+    results = {name: [] for name, _ in cases}
+    frames = {}
+    for _ in range(args.runs):
+        # Alternate cases so drift (thermal, other load) hits all of them
+        for name, fn in cases:
+            t0 = cpu_seconds()
+            frames[name] = fn()
+            results[name].append(cpu_seconds() - t0)
+
+    base = statistics.median(results[cases[0][0]])
+    print(f"{'path':<10} {'frames':>7} {'cpu ms/line':>12} {'cpu ms/s audio':>15} {'vs ' + cases[0][0]:>9}")
+    for name, _ in cases:
+        med = statistics.median(results[name])
+        audio_s = frames[name] * 0.02 or 1
+        print(f"{name:<10} {frames[name]:>7} {med * 1000:>12.1f} {med * 1000 / audio_s:>15.2f} {med / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,37 +6,127 @@ import random
 import asyncio
 import time
 import tempfile
+import io
 import pathlib
 import html
-from collections import deque
+import json
+import hashlib
+import hmac
+import sys
+import threading
+import traceback
+import atexit
+import copy
+import logging
+import logging.handlers
+import queue
+import bisect
+import heapq
+import signal
+import sqlite3
+import subprocess
+import shlex
+import urllib.request
+from array import array
+from collections import deque, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
 import google.generativeai as genai
-from flask import Flask
-from threading import Thread
+import aiohttp
+from aiohttp import web
 from discord.errors import HTTPException
 
+try:
+    from google.api_core import exceptions as gapi_exc
+except ImportError:  # pragma: no cover - ships with google-generativeai
+    gapi_exc = None
+
 # =============================
-# Web server (keep-alive for Render)
+# Web server (keep-alive for Render) — runs on the bot's own event loop
 # =============================
-app = Flask(__name__)
-
-@app.route("/")
-def home():
-    return "Disha is awake — with emotional intelligence!"
-
-@app.route("/health")
-def health():
-    return "ok", 200
-
-def _run():
+class Health:
+    """Process health as seen from the event loop."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.loop_lag = 0.0            # last measured scheduling delay (s)
+        self.gateway_down_since = None  # set on disconnect, cleared on ready/resume
+        self.last_message_at = 0.0
+
+health_state = Health()
+
+async def loop_lag_monitor(interval: float = 0.5):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        health_state.loop_lag = max(0.0, time.perf_counter() - t - interval)
+        H_LOOP_LAG.observe(health_state.loop_lag)
+        watchdog.heartbeat = time.monotonic()
+
+def _gateway_ok() -> bool:
+    down = health_state.gateway_down_since
+    if client.is_ready() and not client.is_closed() and down is None:
+        return True
+    # Still starting up, or reconnecting: give it a grace period
+    since = down if down is not None else health_state.started_at
+    return time.time() - since < GATEWAY_GRACE_SEC
+
+def _health_body() -> dict:
+    latency = client.latency
+    return {
+        "instance": INSTANCE_ID,
+        "ready": client.is_ready(),
+        "gateway_latency_ms": round(latency * 1000, 1) if latency == latency and latency != float("inf") else None,
+        "gateway_down_for": round(time.time() - health_state.gateway_down_since, 1)
+                            if health_state.gateway_down_since else 0,
+        "loop_lag_ms": round(health_state.loop_lag * 1000, 1),
+        "last_message_age": round(time.time() - health_state.last_message_at, 1)
+                            if health_state.last_message_at else None,
+        "uptime": round(time.time() - health_state.started_at, 1),
+    }
+
+async def home(request):
+    return web.Response(text="Disha is awake — with emotional intelligence!")
+
+async def health(request):
+    """Liveness: the loop answers promptly and the gateway isn't stuck down."""
+    alive = health_state.loop_lag < LIVENESS_MAX_LAG and _gateway_ok()
+    return web.json_response(_health_body(), status=200 if alive else 503)
+
+async def ready(request):
+    """Readiness: logged in and connected to the gateway."""
+    ok = client.is_ready() and not client.is_closed() and health_state.gateway_down_since is None
+    return web.json_response(_health_body(), status=200 if ok else 503)
+
+async def debug_profile(request):
+    """/debug/profile?seconds=N&token=PROFILE_TOKEN -> collapsed stacks (off without a token)."""
+    if not PROFILE_TOKEN or not hmac.compare_digest(request.query.get("token", ""), PROFILE_TOKEN):
+        raise web.HTTPNotFound()
+    try:
+        seconds = float(request.query.get("seconds", "10"))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds must be a number")
+    return web.Response(text=await run_profile(seconds), content_type="text/plain",
+                        headers={"Content-Disposition": 'attachment; filename="profile.folded"'})
+
+async def metrics(request):
+    return web.Response(body=render_metrics().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+app = web.Application()
+app.router.add_get("/", home)
+app.router.add_get("/health", health)
+app.router.add_get("/ready", ready)
+app.router.add_get("/metrics", metrics)
+app.router.add_get("/debug/profile", debug_profile)
+
+async def keep_alive():
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
     port = int(os.getenv("PORT", "8080"))
-    app.run(host="0.0.0.0", port=port)
-
-def keep_alive():
-    t = Thread(target=_run)
-    t.daemon = True
-    t.start()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    log.info("web server on :%s", port)
 
 # =============================
 # Secrets / Config
@@ -51,6 +141,13 @@ VOICE_RATE   = os.getenv("VOICE_RATE", "+2%")
 VOICE_PITCH  = os.getenv("VOICE_PITCH", "+10Hz")
 VOICE_STYLE  = os.getenv("VOICE_STYLE", "friendly")
 ENABLE_READ_NAME = os.getenv("ENABLE_READ_NAME", "1") == "1"
+# TTS engine: "edge" (remote neural voice, VOICE_NAME) or "local" (offline,
+# LOCAL_TTS_CMD reads text on stdin and writes audio to stdout). Each guild
+# can switch with !voicemode. TTS_WORKERS bounds concurrent syntheses per engine.
+TTS_BACKEND      = os.getenv("TTS_BACKEND", "edge")
+LOCAL_TTS_CMD    = os.getenv("LOCAL_TTS_CMD", "espeak-ng -v hi -s 165 --stdin --stdout")
+LOCAL_TTS_INPUT  = os.getenv("LOCAL_TTS_INPUT", "")  # FFmpeg input options, e.g. for raw PCM
+TTS_WORKERS      = max(1, int(os.getenv("TTS_WORKERS", "2")))
 
 # ----- Chat behavior -----
 MAX_DISCORD_MSG    = 1700
@@ -58,6 +155,74 @@ MAX_OUTPUT_TOKENS  = 110
 REPLY_COOLDOWN_SEC = 3.5
 SESSION_MAX_TURNS  = 18
 
+# Conversation memory: history persists in MEMORY_DB (set "" to disable and
+# fall back to resetting every SESSION_MAX_TURNS). Once a chat's context passes
+# MEMORY_TOKEN_BUDGET, older turns are folded into a running summary.
+MEMORY_DB            = os.getenv("MEMORY_DB", "disha_memory.db")
+MEMORY_TOKEN_BUDGET  = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+MEMORY_SUMMARY_CHARS = int(os.getenv("MEMORY_SUMMARY_CHARS", "600"))
+
+# Per-user state bounds: max users kept, drop users idle this long, and drop a
+# user's Gemini history after this much silence.
+USER_STORE_MAX = int(os.getenv("USER_STORE_MAX", "5000"))
+USER_IDLE_TTL  = int(os.getenv("USER_IDLE_TTL", "3600"))
+SESSION_TTL    = int(os.getenv("SESSION_TTL", "1800"))
+
+# ----- Model client -----
+MODEL_BACKEND         = os.getenv("MODEL_BACKEND", "gemini")   # "fake" = offline stub, no API key needed
+MODEL_ASYNC           = os.getenv("MODEL_ASYNC", "1") == "1"   # native async API; 0 = private thread pool
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "4"))
+# MODEL_RPM is a hard throttle for the whole bot (summaries included): after a
+# MODEL_BURST burst, at most MODEL_RPM calls a minute go out and the rest wait.
+# Set it to the API key's real quota; the default only suits a free-tier key.
+MODEL_RPM             = float(os.getenv("MODEL_RPM", "60"))    # token-bucket refill (requests/min)
+MODEL_BURST           = int(os.getenv("MODEL_BURST", "8"))
+MODEL_TIMEOUT_SEC     = float(os.getenv("MODEL_TIMEOUT_SEC", "12"))   # per attempt
+MODEL_DEADLINE_SEC    = float(os.getenv("MODEL_DEADLINE_SEC", "20"))  # whole call incl. retries
+MODEL_RETRIES         = int(os.getenv("MODEL_RETRIES", "2"))
+FAKE_MODEL_LATENCY_MS = float(os.getenv("FAKE_MODEL_LATENCY_MS", "400"))
+FAKE_MODEL_ERROR_RATE = float(os.getenv("FAKE_MODEL_ERROR_RATE", "0"))
+
+# Stream model output and speak each sentence as soon as it is complete
+# (only used when the bot is in the user's guild VC).
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+
+# Debounce-and-coalesce: buffer a user's quick message bursts into one prompt.
+# The window adapts to how fast the user types, between MIN and MAX, and a
+# burst is never held longer than HOLD in total.
+ENABLE_COALESCE   = os.getenv("ENABLE_COALESCE", "0") == "1"
+COALESCE_MIN_MS   = int(os.getenv("COALESCE_MIN_MS", "700"))
+COALESCE_MAX_MS   = int(os.getenv("COALESCE_MAX_MS", "2500"))
+COALESCE_HOLD_MS  = int(os.getenv("COALESCE_HOLD_MS", "6000"))
+
+# Admission control: ADMIT_CONCURRENCY replies generate at once, the rest wait
+# by priority (DMs/mentions, then replies to the bot, then engaged follow-ups).
+# ADMIT_DEADLINE_SEC covers queue wait plus the model call, and a reply that
+# can't start with ADMIT_MIN_BUDGET_SEC of it left is shed rather than sent
+# into a call that would time out; follow-ups are shed already after
+# ADMIT_SHED_WAIT_SEC ("drop", or "canned" for a cheap busy line).
+ADMIT_CONCURRENCY   = int(os.getenv("ADMIT_CONCURRENCY", str(MODEL_MAX_CONCURRENCY)))
+ADMIT_QUEUE_MAX     = int(os.getenv("ADMIT_QUEUE_MAX", "200"))
+ADMIT_DEADLINE_SEC  = float(os.getenv("ADMIT_DEADLINE_SEC", "20"))
+ADMIT_SHED_WAIT_SEC = float(os.getenv("ADMIT_SHED_WAIT_SEC", "5"))
+ADMIT_MIN_BUDGET_SEC = float(os.getenv("ADMIT_MIN_BUDGET_SEC", "3"))
+ADMIT_SHED_MODE     = os.getenv("ADMIT_SHED_MODE", "drop")
+
+# Small-talk reply cache (opt-in): short context-free lines ("hi disha", "gn")
+# are answered from up to VARIANTS stored model replies per normalized line.
+REPLY_CACHE           = os.getenv("REPLY_CACHE", "0") == "1"
+REPLY_CACHE_TTL_SEC   = float(os.getenv("REPLY_CACHE_TTL_SEC", "21600"))
+REPLY_CACHE_MAX       = int(os.getenv("REPLY_CACHE_MAX", "500"))
+REPLY_CACHE_VARIANTS  = int(os.getenv("REPLY_CACHE_VARIANTS", "4"))
+REPLY_CACHE_MAX_CHARS = int(os.getenv("REPLY_CACHE_MAX_CHARS", "32"))
+
+# Outbound sends go through a queue per channel (DMs/mentions first). With
+# SEND_MERGE=1, replies queued behind each other in a busy channel go out as
+# one message. SEND_QUEUE_MAX bounds each queue; lowest priority is dropped.
+SEND_MERGE     = os.getenv("SEND_MERGE", "0") == "1"
+SEND_QUEUE_MAX = max(1, int(os.getenv("SEND_QUEUE_MAX", "20")))
+SEND_RETRIES   = int(os.getenv("SEND_RETRIES", "3"))
+
 # After a direct interaction, keep replying to that person in the same channel
 # without @mention for this many seconds (feels more natural).
 AUTO_FOLLOW_WINDOW = int(os.getenv("AUTO_FOLLOW_WINDOW", "240"))  # 4 min
@@ -65,12 +230,420 @@ AUTO_FOLLOW_WINDOW = int(os.getenv("AUTO_FOLLOW_WINDOW", "240"))  # 4 min
 QUESTION_RATIO_HINT = "About one out of three replies may end with a short question; otherwise end with a warm statement."
 
 # TTS debug / summary
-DEBUG_TTS = os.getenv("DEBUG_TTS", "0") == "1"  # set to 1 to log speakable text
+DEBUG_TTS = os.getenv("DEBUG_TTS", "0") == "1"  # set to 1 to log speakable text (or: !loglevel debug tts)
 CODE_SUMMARY_LINE = "Code block mila—main aloud nahi padhungi. Theek hai, aage chalte hain."
+# Fixed lines spoken in VC; pre-encoded at startup so they never wait on TTS
+VOICE_ACKS = {
+    "joinvc": "Join ho gayi—ab main yahan bolungi bhi.",
+}
+# Extra roman -> Devanagari words for TTS (JSON object or TSV), merged over the built-in map
+HINGLISH_DICT_FILE = os.getenv("HINGLISH_DICT_FILE", "")
+
+# TTS audio cache (repeated lines play back without re-synthesis). Each cache
+# has its own size budget; disk use is their sum: TTS_CACHE_MAX_MB (edge-tts
+# clips) + OPUS_CACHE_MAX_MB (pre-encoded Opus copies, in opus/) +
+# LOCAL_TTS_CACHE_MAX_MB (local engine output, in local/; only fills when
+# TTS_BACKEND or !voicemode picks "local").
+TTS_CACHE_DIR         = os.getenv("TTS_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "disha-tts-cache")
+TTS_CACHE_MAX_MB      = float(os.getenv("TTS_CACHE_MAX_MB", "64"))
+OPUS_CACHE_MAX_MB     = float(os.getenv("OPUS_CACHE_MAX_MB", "16"))
+LOCAL_TTS_CACHE_MAX_MB = float(os.getenv("LOCAL_TTS_CACHE_MAX_MB", "32"))
+TTS_CACHE_MAX_ENTRIES = int(os.getenv("TTS_CACHE_MAX_ENTRIES", "400"))
+# Stream TTS chunks straight into FFmpeg (playback starts on the first chunk);
+# set to 0 to always synthesize a full file first.
+ENABLE_TTS_STREAM     = os.getenv("ENABLE_TTS_STREAM", "1") == "1"
+# Per-guild VC queue: max replies waiting (a streamed reply's sentences count
+# as one and are dropped together), and what to do with extra replies from the
+# same user ("drop_oldest" keeps them separate, "merge" joins them).
+VC_QUEUE_MAX          = max(1, int(os.getenv("VC_QUEUE_MAX", "4")))
+VC_QUEUE_POLICY       = os.getenv("VC_QUEUE_POLICY", "drop_oldest")
+# VC audio path. "opus": FFmpeg hands Opus packets straight to Discord (no
+# per-frame encode in Python). The fixed lines, and any clip that plays a
+# second time, are transcoded to Ogg Opus once, then replayed with codec copy. "pcm": decode to PCM, encode in-process.
+VOICE_CODEC           = os.getenv("VOICE_CODEC", "opus")
+OPUS_BITRATE_KBPS     = int(os.getenv("OPUS_BITRATE_KBPS", "64"))
+
+# Message dedupe: ids are remembered for DEDUPE_WINDOW_SEC (older messages are
+# ignored) in fixed memory sized for DEDUPE_CAPACITY ids per window.
+# DEDUPE_FILE shares the filter between processes on one host (mmap + flock).
+DEDUPE_WINDOW_SEC = float(os.getenv("DEDUPE_WINDOW_SEC", "900"))
+DEDUPE_BUCKETS    = int(os.getenv("DEDUPE_BUCKETS", "15"))
+DEDUPE_CAPACITY   = int(os.getenv("DEDUPE_CAPACITY", "50000"))
+DEDUPE_FILE       = os.getenv("DEDUPE_FILE", "")
+
+# Health checks: /health fails if the loop lags this much, or the gateway has
+# been down (or never came up) for longer than the grace period.
+LIVENESS_MAX_LAG  = float(os.getenv("LIVENESS_MAX_LAG_SEC", "2"))
+GATEWAY_GRACE_SEC = float(os.getenv("GATEWAY_GRACE_SEC", "180"))
+
+# Profiling: loop lag is sampled every LOOP_LAG_INTERVAL; a loop stalled longer
+# than LOOP_BLOCK_SEC gets its stack logged. !profile [sec] (ADMIN_USER_IDS) or
+# /debug/profile?seconds=N&token=PROFILE_TOKEN return a sampled flamegraph input.
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_BLOCK_SEC    = float(os.getenv("LOOP_BLOCK_SEC", "0.5"))
+PROFILE_TOKEN     = os.getenv("PROFILE_TOKEN", "")
+PROFILE_MAX_SEC   = float(os.getenv("PROFILE_MAX_SEC", "30"))
+
+# Runtime profile. "lean" trims discord.py caches for big servers: minimal
+# intents, MESSAGE_CACHE_SIZE messages cached (0 = none), members cached only
+# while in voice, and no member chunking at startup.
+RUNTIME_PROFILE    = os.getenv("RUNTIME_PROFILE", "default")
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "0"))
 
 # Diagnostics (to detect duplicate hosts if needed)
 INSTANCE_ID = os.getenv("RENDER_INSTANCE_ID") or os.getenv("HOSTNAME") or str(os.getpid())
 
+# Logging: JSON lines (LOG_FORMAT=text for humans) written by a background
+# thread. Each WARNING-and-up message template gets LOG_RATE_BURST lines per
+# LOG_RATE_WINDOW_SEC window, then 1 in LOG_SAMPLE_EVERY; INFO/DEBUG (e.g. the
+# per-reply latency line) is never sampled, only filtered by level. Levels can be changed live with !loglevel by
+# ADMIN_USER_IDS (comma-separated Discord user ids).
+LOG_LEVEL        = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT       = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_MAX    = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+LOG_RATE_BURST   = int(os.getenv("LOG_RATE_BURST", "20"))
+LOG_RATE_WINDOW_SEC = float(os.getenv("LOG_RATE_WINDOW_SEC", "60"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+ADMIN_USER_IDS   = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").split(",") if x.strip()}
+
+# ----- Scale-out -----
+# SHARD_WORKERS=N runs a supervisor that starts N worker processes, each an
+# AutoShardedClient over a slice of SHARD_COUNT shards (default: Discord's
+# recommendation, rounded up to a multiple of N). Workers share dedupe,
+# cooldowns, engaged windows and session ownership through SHARED_STATE_DB.
+# MODEL_RPM, MODEL_BURST and MODEL_MAX_CONCURRENCY are bot-wide: each worker
+# gets 1/N of them. Each worker keeps its TTS cache in TTS_CACHE_DIR/worker-<i>
+# with 1/N of each TTS cache budget and of TTS_CACHE_MAX_ENTRIES.
+SHARD_WORKERS   = int(os.getenv("SHARD_WORKERS", "0"))
+SHARD_COUNT     = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS       = [int(x) for x in os.getenv("SHARD_IDS", "").split(",") if x.strip()]
+SHARD_WORKER    = int(os.getenv("SHARD_WORKER", "0"))
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "")
+WORKER_ID       = f"{INSTANCE_ID}/{os.getpid()}"
+
+# =============================
+# Metrics (Prometheus text format, no extra dependency)
+# =============================
+class Histogram:
+    """Cumulative-bucket histogram; observe() is a bisect and two adds."""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        METRICS.append(self)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def since(self, started: float):
+        self.observe(time.perf_counter() - started)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            yield f'{self.name}_bucket{{le="{bound}"}} {total}'
+        total += self.counts[-1]
+        yield f'{self.name}_bucket{{le="+Inf"}} {total}'
+        yield f"{self.name}_sum {self.sum}"
+        yield f"{self.name}_count {total}"
+
+class MetricCounter:
+    """Counter with one optional label; values keyed by label value."""
+
+    def __init__(self, name: str, help_text: str, label: str = ""):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = Counter()
+        METRICS.append(self)
+
+    def inc(self, label_value: str = "", n: float = 1):
+        self.values[label_value] += n
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for value, n in list(self.values.items()):
+            labels = f'{{{self.label}="{value}"}}' if self.label else ""
+            yield f"{self.name}{labels} {n}"
+
+class GaugeFn:
+    """Gauge read at scrape time from a callback, so the hot path pays nothing."""
+
+    def __init__(self, name: str, help_text: str, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        METRICS.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            yield f"{self.name} {float(self.fn())}"
+        except Exception:
+            yield f"{self.name} NaN"
+
+METRICS = []
+
+def render_metrics() -> str:
+    return "\n".join(line for m in list(METRICS) for line in m.render()) + "\n"
+
+H_REPLY     = Histogram("disha_generate_reply_seconds", "Model reply time incl. queueing and retries")
+H_TTS_SYNTH = Histogram("disha_tts_synth_seconds", "Time until a TTS clip is ready to play")
+H_TTS_PLAY  = Histogram("disha_tts_playback_seconds", "VC playback time per clip")
+H_SEND      = Histogram("disha_send_seconds", "Discord message send time")
+C_SKIPPED   = MetricCounter("disha_skipped_messages_total", "Messages not answered", "reason")
+C_SEND_429  = MetricCounter("disha_send_429_retries_total", "Sends retried after a 429")
+C_AI_ERRORS = MetricCounter("disha_ai_errors_total", "Model calls that fell back to a canned line", "outcome")
+H_SEND_WAIT = Histogram("disha_send_queue_wait_seconds", "Time a message waited in its channel's send queue")
+C_SEND_MERGED  = MetricCounter("disha_send_merged_total", "Queued messages merged into an earlier send")
+H_ADMIT_WAIT = Histogram("disha_admission_wait_seconds", "Time a reply waited for an admission slot")
+C_SHED       = MetricCounter("disha_shed_total", "Replies shed by admission control", "reason")
+C_ADMIT_MERGED = MetricCounter("disha_admission_merged_total", "Messages merged into a user's waiting ticket")
+C_REPLY_CACHE = MetricCounter("disha_reply_cache_total", "Small-talk reply cache lookups", "result")
+H_LOOP_LAG  = Histogram("disha_loop_lag_sample_seconds", "Event-loop scheduling delay per sample",
+                        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+C_LOOP_BLOCKS = MetricCounter("disha_loop_blocked_total", "Times the event loop stalled past LOOP_BLOCK_SEC")
+C_SEND_DROPPED = MetricCounter("disha_send_dropped_total", "Messages never sent", "reason")
+C_LOG_DROPPED = MetricCounter("disha_log_dropped_total", "Log records dropped because the log queue was full")
+C_COMPACTIONS = MetricCounter("disha_memory_compactions_total", "Conversation summaries rewritten")
+C_COALESCE  = MetricCounter("disha_coalesce_total", "Coalesced bursts flushed and messages merged into them", "event")
+C_VC_QUEUE  = MetricCounter("disha_vc_queue_total", "VC replies the per-guild queue dropped or merged", "event")
+
+# =============================
+# Logging (JSON lines, written by a background thread)
+# =============================
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; extra= fields listed in FIELDS are kept."""
+
+    FIELDS = ("guild", "channel", "user", "latency_ms", "outcome", "suppressed", "stack")
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "instance": WORKER_ID,
+            "msg": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                out[field] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Per message template at `level` and up: `burst` records per `window`
+    seconds, then 1 in `sample`. Lower levels pass untouched.
+
+    The next record let through carries how many were suppressed before it.
+    """
+
+    def __init__(self, burst: int, window: float, sample: int, level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.sample = max(1, sample)
+        self.level = level
+        self._windows = {}  # (logger, level, template) -> [window start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = record.created
+        w = self._windows.get(key)
+        if w is None or now - w[0] >= self.window:
+            if len(self._windows) > 1024:
+                self._windows.clear()
+            suppressed = w[2] if w else 0
+            w = self._windows[key] = [now, 0, 0]
+            if suppressed:
+                record.suppressed = suppressed
+        w[1] += 1
+        if w[1] <= self.burst or (w[1] - self.burst) % self.sample == 0:
+            if w[2] and not getattr(record, "suppressed", None):
+                record.suppressed = w[2]
+                w[2] = 0
+            return True
+        w[2] += 1
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: a full queue drops the record and counts it."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now (they may change later); keep the traceback separate
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            C_LOG_DROPPED.inc()
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """stop() waits for room for its sentinel instead of failing on a full queue."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+def setup_logging() -> logging.handlers.QueueListener:
+    out = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        out.setFormatter(JsonFormatter())
+    else:
+        out.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_MAX))
+    handler.addFilter(RateLimitFilter(LOG_RATE_BURST, LOG_RATE_WINDOW_SEC, LOG_SAMPLE_EVERY))
+    for name in ("disha", "discord"):
+        logger = logging.getLogger(name)
+        logger.addHandler(handler)
+        logger.propagate = False
+    logging.getLogger("disha").setLevel(LOG_LEVEL)
+    logging.getLogger("discord").setLevel(logging.INFO)
+    if DEBUG_TTS:
+        logging.getLogger("disha.tts").setLevel(logging.DEBUG)
+    listener = DrainingQueueListener(handler.queue, out, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # flush what's queued on exit
+    return listener
+
+def log_fields(message=None, guild=None, user=None, latency: float = None) -> dict:
+    """extra= for a log call: ids from a message (or given), latency in ms."""
+    if message is not None:
+        guild = message.guild
+        user = message.author
+    fields = {}
+    if guild is not None:
+        fields["guild"] = getattr(guild, "id", guild)
+    if message is not None:
+        fields["channel"] = getattr(message.channel, "id", None)
+    if user is not None:
+        fields["user"] = getattr(user, "id", user)
+    if latency is not None:
+        fields["latency_ms"] = round(latency * 1000, 1)
+    return fields
+
+_log_listener = setup_logging()
+log      = logging.getLogger("disha")
+ai_log   = logging.getLogger("disha.ai")
+tts_log  = logging.getLogger("disha.tts")
+send_log = logging.getLogger("disha.send")
+mem_log  = logging.getLogger("disha.memory")
+
+# =============================
+# Profiling (loop watchdog, sampling profiler)
+# =============================
+class LoopWatchdog:
+    """Thread that notices when the event loop stops ticking.
+
+    loop_lag_monitor() stamps a heartbeat every LOOP_LAG_INTERVAL; if the
+    stamp is older than LOOP_BLOCK_SEC, whatever the loop thread is running
+    right now is the blocker, so its stack is logged (once per stall).
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.loop_thread = None
+        self.blocks = 0
+        self._thread = None
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.threshold / 2)
+            beat = self.heartbeat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or reported == beat:
+                continue
+            reported = beat
+            self.blocks += 1
+            C_LOOP_BLOCKS.inc()
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "?"
+            log.warning("event loop blocked for %.0f ms", stalled * 1000, extra={"stack": stack})
+
+watchdog = LoopWatchdog(LOOP_BLOCK_SEC)
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """Sample every thread's stack for `seconds`; return collapsed stacks.
+
+    Output is Brendan Gregg's folded format ("thread;outer;...;inner count"),
+    ready for flamegraph.pl or speedscope. Runs in the calling thread.
+    """
+    me = threading.get_ident()
+    names = {}
+    folded = Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if tid not in names:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            stack.append(names.get(tid, str(tid)))
+            folded[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {n}\n" for stack, n in folded.most_common())
+
+_PROFILE_LOCK = asyncio.Lock()
+
+async def run_profile(seconds: float) -> str:
+    """Time-boxed sampling profile on a private thread (one at a time)."""
+    seconds = min(max(0.5, seconds), PROFILE_MAX_SEC)
+    async with _PROFILE_LOCK:
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def work():
+            try:
+                out = sample_stacks(seconds)
+            except Exception as e:
+                loop.call_soon_threadsafe(done.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(done.set_result, out)
+
+        # Own thread: the default executor may be the very thing that is saturated
+        threading.Thread(target=work, name="profiler", daemon=True).start()
+        return await done
+
 # =============================
 # Persona + Style Contract
 # =============================
@@ -92,9 +665,71 @@ FEWSHOT = [
 # =============================
 # Gemini init
 # =============================
+class FakeModelError(Exception):
+    """Transient error raised by the fake backend (treated as retryable)."""
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeChat:
+    REPLIES = (
+        "Haan yaar, samajh rahi hoon—thoda sa chill karo, sab theek hoga. 🙂",
+        "Acha laga sunke! Aaj ka vibe kaafi mast lag raha hai.",
+        "Hmm, interesting hai yeh. Tum batate raho, main sun rahi hoon.",
+        "Bas yahin hoon, halka sa music chal raha hai. Tumhara din kaisa gaya?",
+    )
+
+    def __init__(self, owner, history):
+        self.owner = owner
+        self.history = list(history or [])
+
+    def _reply(self, content) -> _FakeResponse:
+        if random.random() < self.owner.error_rate:
+            raise FakeModelError("fake backend: 503 unavailable")
+        text = random.choice(self.REPLIES)
+        self.history.append({"role": "user", "parts": str(content)})
+        self.history.append({"role": "model", "parts": text})
+        return _FakeResponse(text)
+
+    def send_message(self, content, stream=False):
+        time.sleep(self.owner.latency)
+        resp = self._reply(content)
+        return self._chunks(resp.text) if stream else resp
+
+    async def send_message_async(self, content, stream=False):
+        await asyncio.sleep(self.owner.latency)
+        resp = self._reply(content)
+        return self._achunks(resp.text) if stream else resp
+
+    @staticmethod
+    def _chunks(text: str):
+        # Token-ish pieces, like a streamed response
+        for i in range(0, len(text), 12):
+            yield _FakeResponse(text[i:i + 12])
+
+    async def _achunks(self, text: str):
+        per_chunk = self.owner.latency / 8
+        for chunk in self._chunks(text):
+            await asyncio.sleep(per_chunk)
+            yield chunk
+
+class FakeModel:
+    """Offline stand-in for genai.GenerativeModel (MODEL_BACKEND=fake)."""
+
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
 model = None
 try:
-    if GOOGLE_API_KEY:
+    if MODEL_BACKEND == "fake":
+        model = FakeModel(FAKE_MODEL_LATENCY_MS / 1000, FAKE_MODEL_ERROR_RATE)
+        log.info("fake model backend")
+    elif GOOGLE_API_KEY:
         genai.configure(api_key=GOOGLE_API_KEY)
         generation_config = {
             "temperature": 0.75,
@@ -107,79 +742,728 @@ try:
             generation_config=generation_config,
             system_instruction=SYSTEM_INSTRUCTION,
         )
-        print("[OK] Gemini initialized")
+        log.info("gemini initialized")
     else:
-        print("[WARN] GOOGLE_API_KEY not set; AI replies disabled")
+        log.warning("GOOGLE_API_KEY not set; AI replies disabled")
 except Exception as e:
-    print(f"[ERROR] Gemini init failed: {e}")
+    log.error("gemini init failed: %s", e)
+
+# =============================
+# Model client (concurrency cap, quota, deadlines, retries)
+# =============================
+_RETRYABLE = (asyncio.TimeoutError, ConnectionError, FakeModelError)
+if gapi_exc is not None:
+    _RETRYABLE += (gapi_exc.ResourceExhausted, gapi_exc.ServiceUnavailable,
+                   gapi_exc.InternalServerError, gapi_exc.DeadlineExceeded)
+
+# Raised by every send on a chat whose last streamed turn broke or was abandoned
+_BROKEN_SESSION = (genai.types.BrokenResponseError, genai.types.IncompleteIterationError)
+
+def _chunk_text(chunk) -> str:
+    try:
+        return getattr(chunk, "text", "") or ""
+    except ValueError:  # chunk with no text parts (e.g. safety stop)
+        return ""
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate = rate_per_sec
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ModelClient:
+    """All model calls go through here.
+
+    A semaphore caps in-flight calls, a token bucket keeps us under the API
+    quota, each attempt gets a timeout and the whole call a deadline, and
+    retryable errors back off with full jitter. Latency is tracked per outcome.
+    """
+
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 4.0
+
+    def __init__(self, max_concurrency: int, rpm: float, burst: int,
+                 timeout: float, deadline: float, retries: int):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self._sem = asyncio.Semaphore(max(1, max_concurrency))
+        self._bucket = TokenBucket(max(rpm, 0.1) / 60.0, burst)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency),
+                                            thread_name_prefix="model")
+        self.in_flight = 0
+        self.retried = 0
+        self.stats = {}  # outcome -> [count, total_sec, max_sec]
+
+    def _record(self, outcome: str, started: float):
+        took = time.perf_counter() - started
+        row = self.stats.setdefault(outcome, [0, 0.0, 0.0])
+        row[0] += 1
+        row[1] += took
+        row[2] = max(row[2], took)
+
+    @staticmethod
+    def _outcome(e: BaseException) -> str:
+        if isinstance(e, asyncio.TimeoutError):
+            return "timeout"
+        if gapi_exc is not None and isinstance(e, gapi_exc.ResourceExhausted):
+            return "quota"
+        if isinstance(e, _RETRYABLE):
+            return "unavailable"
+        return "error"
+
+    async def _attempt(self, session, prompt):
+        send_async = getattr(session, "send_message_async", None) if MODEL_ASYNC else None
+        if send_async is not None:
+            return await send_async(prompt)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, session.send_message, prompt)
+
+    def _end(self, started: float, until) -> float:
+        # `until` (time.monotonic()) is the caller's own deadline, e.g. an admission ticket's
+        end = started + self.deadline
+        if until is not None:
+            end = min(end, started + until - time.monotonic())
+        return end
+
+    async def send(self, session, prompt, until: float = None):
+        started = time.perf_counter()
+        end = self._end(started, until)
+        attempt = 0
+        while True:
+            # Quota first: a call waiting for a token must not hold a concurrency slot
+            await self._bucket.acquire()
+            try:
+                async with self._sem:
+                    remaining = end - time.perf_counter()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    self.in_flight += 1
+                    try:
+                        resp = await asyncio.wait_for(self._attempt(session, prompt),
+                                                      min(self.timeout, remaining))
+                    finally:
+                        self.in_flight -= 1
+                self._record("ok", started)
+                return resp
+            except _RETRYABLE as e:
+                delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+                if attempt >= self.retries or time.perf_counter() + delay >= end:
+                    self._record(self._outcome(e), started)
+                    raise
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+            except Exception as e:
+                self._record(self._outcome(e), started)
+                raise
+
+    async def _stream_attempt(self, session, prompt):
+        send_async = getattr(session, "send_message_async", None) if MODEL_ASYNC else None
+        if send_async is not None:
+            resp = await send_async(prompt, stream=True)
+            async for chunk in resp:
+                text = _chunk_text(chunk)
+                if text:
+                    yield text
+            return
+        # Bridge the SDK's blocking iterator from the private pool
+        loop = asyncio.get_running_loop()
+        q = asyncio.Queue()
+        done = object()
+
+        def pump():
+            try:
+                for chunk in session.send_message(prompt, stream=True):
+                    loop.call_soon_threadsafe(q.put_nowait, _chunk_text(chunk))
+                loop.call_soon_threadsafe(q.put_nowait, done)
+            except BaseException as e:
+                loop.call_soon_threadsafe(q.put_nowait, e)
+
+        loop.run_in_executor(self._executor, pump)
+        while True:
+            item = await q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            if item:
+                yield item
+
+    async def stream(self, session, prompt, until: float = None):
+        """Like send(), but yields text chunks. Retries only happen before the first chunk."""
+        started = time.perf_counter()
+        end = self._end(started, until)
+        attempt = 0
+        while True:
+            await self._bucket.acquire()  # before the semaphore, as in send()
+            async with self._sem:
+                self.in_flight += 1
+                try:
+                    chunks = self._stream_attempt(session, prompt)
+                    remaining = end - time.perf_counter()
+                    try:
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        first = await asyncio.wait_for(chunks.__anext__(), min(self.timeout, remaining))
+                    except StopAsyncIteration:
+                        self._record("ok", started)
+                        return
+                    except _RETRYABLE as e:
+                        await chunks.aclose()
+                        delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+                        if attempt >= self.retries or time.perf_counter() + delay >= end:
+                            self._record(self._outcome(e), started)
+                            raise
+                    except Exception as e:
+                        self._record(self._outcome(e), started)
+                        raise
+                    else:
+                        self._record("first_chunk", started)
+                        yield first
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(),
+                                                               max(0.001, end - time.perf_counter()))
+                            except StopAsyncIteration:
+                                break
+                            except Exception as e:
+                                self._record(self._outcome(e), started)
+                                raise
+                            yield chunk
+                        self._record("ok", started)
+                        return
+                finally:
+                    self.in_flight -= 1
+            # Back off outside the semaphore so the slot serves someone else
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    def report(self) -> dict:
+        out = {"in_flight": self.in_flight, "retries": self.retried}
+        for outcome, (n, total, worst) in self.stats.items():
+            out[outcome] = {"count": n, "avg_ms": round(1000 * total / n, 1), "max_ms": round(1000 * worst, 1)}
+        return out
+
+model_client = ModelClient(MODEL_MAX_CONCURRENCY, MODEL_RPM, MODEL_BURST,
+                           MODEL_TIMEOUT_SEC, MODEL_DEADLINE_SEC, MODEL_RETRIES)
 
 # =============================
 # Discord client
 # =============================
-intents = discord.Intents.default()
-intents.message_content = True
-client = discord.Client(intents=intents)
+def client_options(profile: str) -> dict:
+    """discord.Client kwargs for a RUNTIME_PROFILE."""
+    if profile != "lean":
+        intents = discord.Intents.default()
+        intents.message_content = True
+        return {"intents": intents}
+    # Only what on_message and the VC code read: messages, guild/channel
+    # objects and voice states. No typing/reaction/emoji/invite events.
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    intents.voice_states = True
+    member_flags = discord.MemberCacheFlags.none()
+    member_flags.voice = True  # join_user_channel needs author.voice
+    return {
+        "intents": intents,
+        "max_messages": MESSAGE_CACHE_SIZE or None,
+        "member_cache_flags": member_flags,
+        "chunk_guilds_at_startup": False,
+    }
+
+if SHARD_IDS:
+    client = discord.AutoShardedClient(shard_ids=SHARD_IDS, shard_count=SHARD_COUNT,
+                                       **client_options(RUNTIME_PROFILE))
+else:
+    client = discord.Client(**client_options(RUNTIME_PROFILE))
+
+async def replied_to_bot(message: discord.Message, fetch: bool = True) -> bool:
+    ref = message.reference
+    if ref is None or ref.message_id is None:
+        return False
+    target = ref.resolved
+    if target is None and fetch:
+        # Not sent inline (and no message cache in the lean profile): fetch it
+        try:
+            target = await message.channel.fetch_message(ref.message_id)
+        except HTTPException:
+            return False
+    # Duck-typed: a DeletedReferencedMessage has no author
+    return getattr(target, "author", None) == client.user
 
 # =============================
-# Guards / helpers
+# Shared cross-process state (SQLite WAL)
 # =============================
-chat_sessions = {}             # user_id -> session
-session_turns = {}             # user_id -> turns count
-user_locks = {}                # user_id -> asyncio.Lock
-last_reply_at = {}             # user_id -> ts
+class SharedState:
+    """State every worker on this host must agree on.
 
-# One-reply-per-message (within this process)
-_PROCESSED_IDS = set()
-_PROCESSED_ORDER = deque(maxlen=10000)
-_LAST_REPLY_NORM = {}  # user_id -> last normalized reply
+    Each call is one short autocommit statement on a local WAL database, so
+    readers never block the writer and the cost is tens of microseconds.
+    """
 
-# Keep “engaged” users per (guild, channel, user) with expiry
-ENGAGED = {}  # key=(guild_id or 0 for DM, channel_id or 0 for DM, user_id) -> expiry_ts
+    PRUNE_EVERY = 60.0
+    PROCESSED_KEEP = 3600.0
+
+    def __init__(self, path: str, worker_id: str):
+        self.worker_id = worker_id
+        self.db = sqlite3.connect(path, timeout=2.0, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS processed (mid INTEGER PRIMARY KEY, ts REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS cooldown (uid INTEGER PRIMARY KEY, until REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS engaged (
+                uid INTEGER, gid INTEGER, cid INTEGER, until REAL NOT NULL,
+                PRIMARY KEY (uid, gid, cid));
+            CREATE TABLE IF NOT EXISTS owner (uid INTEGER PRIMARY KEY, worker TEXT NOT NULL, ts REAL NOT NULL);
+        """)
+        self._last_prune = 0.0
+
+    def claim_message(self, mid: int) -> bool:
+        """True for exactly one worker per message id."""
+        cur = self.db.execute("INSERT OR IGNORE INTO processed (mid, ts) VALUES (?, ?)", (mid, time.time()))
+        return cur.rowcount == 1
+
+    def cooldown_until(self, uid: int) -> float:
+        row = self.db.execute("SELECT until FROM cooldown WHERE uid = ?", (uid,)).fetchone()
+        return row[0] if row else 0.0
+
+    def set_cooldown(self, uid: int, until: float):
+        self.db.execute("INSERT OR REPLACE INTO cooldown (uid, until) VALUES (?, ?)", (uid, until))
+
+    def engaged_until(self, uid: int, key: tuple) -> float:
+        row = self.db.execute("SELECT until FROM engaged WHERE uid = ? AND gid = ? AND cid = ?",
+                              (uid, key[0], key[1])).fetchone()
+        return row[0] if row else 0.0
+
+    def set_engaged(self, uid: int, key: tuple, until: float):
+        self.db.execute("INSERT OR REPLACE INTO engaged (uid, gid, cid, until) VALUES (?, ?, ?, ?)",
+                        (uid, key[0], key[1], until))
+
+    def claim_session(self, uid: int) -> bool:
+        """Make this worker the owner of uid's chat; False if someone else had it."""
+        row = self.db.execute("SELECT worker FROM owner WHERE uid = ?", (uid,)).fetchone()
+        self.db.execute("INSERT OR REPLACE INTO owner (uid, worker, ts) VALUES (?, ?, ?)",
+                        (uid, self.worker_id, time.time()))
+        return row is None or row[0] == self.worker_id
+
+    def prune(self, now: float):
+        if now - self._last_prune < self.PRUNE_EVERY:
+            return
+        self._last_prune = now
+        self.db.execute("DELETE FROM processed WHERE ts < ?", (now - self.PROCESSED_KEEP,))
+        self.db.execute("DELETE FROM cooldown WHERE until < ?", (now,))
+        self.db.execute("DELETE FROM engaged WHERE until < ?", (now,))
+        self.db.execute("DELETE FROM owner WHERE ts < ?", (now - USER_IDLE_TTL,))
+
+shared_state = SharedState(SHARED_STATE_DB, WORKER_ID) if SHARED_STATE_DB else None
 
-def mark_engaged(message: discord.Message, uid: int):
+# =============================
+# Per-user state (bounded store + timer-wheel expiry)
+# =============================
+class UserState:
+    __slots__ = ("session", "turns", "lock", "last_reply_at", "last_reply_norm",
+                 "engaged", "last_seen", "session_check", "burst_gap", "ctx_tokens", "talked")
+
+    def __init__(self, now: float):
+        self.session = None          # Gemini ChatSession
+        self.turns = 0
+        self.lock = None             # asyncio.Lock, created on first reply
+        self.last_reply_at = 0.0
+        self.last_reply_norm = ""
+        self.engaged = None          # (guild_id, channel_id) -> expiry_ts
+        self.last_seen = now
+        self.session_check = False   # a session-TTL timer is pending
+        self.burst_gap = 0.0         # smoothed gap between this user's quick messages
+        self.ctx_tokens = 0          # estimated conversation tokens in the live session
+        self.talked = False          # has had a reply, so nothing they say is an opener
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule, one bucket visited per tick.
+
+    Callbacks re-check the real deadline themselves, so stale timers are cheap
+    no-ops and nothing ever needs to be cancelled.
+    """
+
+    def __init__(self, slots: int = 512, resolution: float = 1.0):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]
+        self.pending = 0
+        self._tick = int(time.time() / resolution)
+
+    def schedule(self, deadline: float, callback, *args):
+        tick = max(int(deadline / self.resolution) + 1, self._tick + 1)
+        self.slots[tick % len(self.slots)].append((tick, callback, args))
+        self.pending += 1
+
+    def advance(self, now: float):
+        target = int(now / self.resolution)
+        n = len(self.slots)
+        if target - self._tick > n:
+            self._tick = target - n  # fell far behind; one lap covers every bucket
+        while self._tick < target:
+            self._tick += 1
+            i = self._tick % n
+            bucket = self.slots[i]
+            if not bucket:
+                continue
+            due = [e for e in bucket if e[0] <= self._tick]
+            if not due:
+                continue
+            self.slots[i] = [e for e in bucket if e[0] > self._tick]
+            self.pending -= len(due)
+            for _, callback, args in due:
+                try:
+                    callback(*args)
+                except Exception:
+                    log.exception("sweep callback failed")
+
+class UserStore:
+    """UserState records with a size cap (LRU), idle TTL and session TTL."""
+
+    def __init__(self, max_entries: int, idle_ttl: float, session_ttl: float, wheel: TimerWheel):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.session_ttl = session_ttl
+        self.wheel = wheel
+        self.evicted = 0
+        self._users = OrderedDict()  # user_id -> UserState, least recently seen first
+
+    def __len__(self):
+        return len(self._users)
+
+    def peek(self, uid: int):
+        return self._users.get(uid)
+
+    def get(self, uid: int) -> UserState:
+        now = time.time()
+        st = self._users.get(uid)
+        if st is None:
+            st = self._users[uid] = UserState(now)
+            self.wheel.schedule(now + self.idle_ttl, self._expire_idle, uid)
+            self._evict()
+        else:
+            self._users.move_to_end(uid)
+            st.last_seen = now
+        return st
+
+    def lock_for(self, st: UserState) -> asyncio.Lock:
+        if st.lock is None:
+            st.lock = asyncio.Lock()
+        return st.lock
+
+    def set_session(self, st: UserState, uid: int, session):
+        st.session = session
+        st.turns = 0
+        if not st.session_check:
+            st.session_check = True
+            self.wheel.schedule(time.time() + self.session_ttl, self._expire_session, uid)
+
+    def drop_session(self, uid: int):
+        st = self._users.get(uid)
+        if st:
+            st.session = None
+            st.turns = 0
+
+    def set_engaged(self, st: UserState, uid: int, key: tuple, expiry: float):
+        if st.engaged is None:
+            st.engaged = {}
+        if key not in st.engaged:
+            self.wheel.schedule(expiry, self._expire_engaged, uid, key)
+        st.engaged[key] = expiry
+
+    def mark_replied(self, st: UserState, uid: int, now: float):
+        st.last_reply_at = now
+        self.wheel.schedule(now + REPLY_COOLDOWN_SEC, self._expire_cooldown, uid)
+
+    @staticmethod
+    def _busy(st: UserState) -> bool:
+        return st.lock is not None and st.lock.locked()
+
+    def _evict(self):
+        skipped = 0
+        while len(self._users) > self.max_entries and skipped < len(self._users):
+            uid, st = next(iter(self._users.items()))
+            if self._busy(st):
+                self._users.move_to_end(uid)  # mid-reply; try the next oldest
+                skipped += 1
+                continue
+            del self._users[uid]
+            self.evicted += 1
+
+    # --- timer callbacks (run by the sweeper) ---
+    def _expire_idle(self, uid: int):
+        st = self._users.get(uid)
+        if st is None:
+            return
+        due = st.last_seen + self.idle_ttl
+        if due <= time.time() and not self._busy(st):
+            del self._users[uid]
+            self.evicted += 1
+        else:
+            self.wheel.schedule(max(due, time.time() + self.wheel.resolution), self._expire_idle, uid)
+
+    def _expire_session(self, uid: int):
+        st = self._users.get(uid)
+        if st is None:
+            return
+        due = st.last_seen + self.session_ttl
+        if st.session is None:
+            st.session_check = False
+        elif due <= time.time() and not self._busy(st):
+            st.session = None
+            st.turns = 0
+            st.session_check = False
+        else:
+            self.wheel.schedule(max(due, time.time() + self.wheel.resolution), self._expire_session, uid)
+
+    def _expire_engaged(self, uid: int, key: tuple):
+        st = self._users.get(uid)
+        if st is None or not st.engaged or key not in st.engaged:
+            return
+        exp = st.engaged[key]
+        if exp <= time.time():
+            del st.engaged[key]
+            if not st.engaged:
+                st.engaged = None
+        else:
+            self.wheel.schedule(exp, self._expire_engaged, uid, key)
+
+    def _expire_cooldown(self, uid: int):
+        st = self._users.get(uid)
+        if st and st.last_reply_at and st.last_reply_at + REPLY_COOLDOWN_SEC <= time.time():
+            st.last_reply_at = 0.0
+
+    def report(self) -> dict:
+        sessions = engaged = turns = 0
+        approx = sys.getsizeof(self._users)
+        for st in self._users.values():
+            approx += sys.getsizeof(st) + sys.getsizeof(st.last_reply_norm)
+            if st.session is not None:
+                sessions += 1
+                turns += len(getattr(st.session, "history", ()) or ())
+            if st.engaged:
+                engaged += len(st.engaged)
+                approx += sys.getsizeof(st.engaged)
+        return {
+            "users": len(self._users),
+            "sessions": sessions,
+            "history_msgs": turns,
+            "engaged": engaged,
+            "evicted": self.evicted,
+            "timers": self.wheel.pending,
+            "approx_bytes": approx,
+        }
+
+timer_wheel = TimerWheel()
+users = UserStore(USER_STORE_MAX, USER_IDLE_TTL, SESSION_TTL, timer_wheel)
+
+GaugeFn("disha_users", "Users held in the state store", lambda: len(users))
+GaugeFn("disha_sessions", "Users with a live model chat session",
+        lambda: sum(1 for st in list(users._users.values()) if st.session is not None))
+GaugeFn("disha_engaged_users", "Users inside an auto-follow window",
+        lambda: sum(1 for st in list(users._users.values()) if st.engaged))
+GaugeFn("disha_vc_connections", "Connected voice clients", lambda: len(client.voice_clients))
+GaugeFn("disha_model_in_flight", "Model calls in flight", lambda: model_client.in_flight)
+GaugeFn("disha_send_queue_depth", "Messages waiting in channel send queues",
+        lambda: sum(len(s.queue) for s in list(senders.values())))
+GaugeFn("disha_admission_queue_depth", "Replies waiting for an admission slot", lambda: admission.depth())
+GaugeFn("disha_admission_running", "Replies being generated", lambda: admission.running)
+GaugeFn("disha_loop_lag_seconds", "Event-loop scheduling delay", lambda: health_state.loop_lag)
+_SWEEPER = None
+
+async def sweeper():
+    while True:
+        await asyncio.sleep(timer_wheel.resolution)
+        now = time.time()
+        timer_wheel.advance(now)
+        if shared_state:
+            shared_state.prune(now)
+
+# One-reply-per-message (within this process, or this host with DEDUPE_FILE)
+class SnowflakeWindow:
+    """Seen-message filter bounded by time and memory.
+
+    A snowflake carries its creation time, so ids are filed into `buckets`
+    rings that each cover window/buckets seconds; a ring is wiped when its
+    slot comes round again. Each ring is a fixed open-addressing table of
+    uint64 ids, so memory never grows and a check is a few array probes.
+    Ids older than the window are reported as seen (too late to answer).
+
+    With `path`, the tables live in an mmap'd file guarded by flock, so every
+    process on the host shares one filter.
+    """
+
+    MAGIC = 0x44495348_44445550  # "DISHDDUP"
+    HEADER = 4  # magic, buckets, slots, bucket_ms (uint64 each)
+
+    def __init__(self, window_sec: float, buckets: int, capacity: int, path: str = ""):
+        self.buckets = max(2, buckets)
+        self.bucket_ms = max(1, int(window_sec * 1000 / self.buckets))
+        per_ring = max(16, 2 * capacity // self.buckets)  # load factor <= 0.5
+        self.slots = 1 << (per_ring - 1).bit_length()
+        self.mask = self.slots - 1
+        self.ring = 2 + self.slots  # epoch, count, ids...
+        size = 8 * (self.HEADER + self.buckets * self.ring)
+        self.stats = {"seen": 0, "duplicates": 0, "stale": 0, "overflow": 0}
+        self._fd = None
+        if path:
+            import fcntl
+            import mmap
+            self._flock = fcntl.flock
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._flock(self._fd, fcntl.LOCK_EX)
+            try:
+                fresh = os.fstat(self._fd).st_size != size
+                if fresh:
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, size)  # zero-filled
+                self._buf = mmap.mmap(self._fd, size)
+                self._ids = memoryview(self._buf).cast("Q")
+                if fresh or tuple(self._ids[:self.HEADER]) != self._header():
+                    self._ids[:] = array("Q", bytes(size))
+                    self._ids[:self.HEADER] = array("Q", self._header())
+            finally:
+                self._flock(self._fd, fcntl.LOCK_UN)
+            self._lock_ex, self._unlock = fcntl.LOCK_EX, fcntl.LOCK_UN
+        else:
+            self._buf = bytearray(size)
+            self._ids = memoryview(self._buf).cast("Q")
+            self._ids[:self.HEADER] = array("Q", self._header())
+
+    def _header(self) -> tuple:
+        return (self.MAGIC, self.buckets, self.slots, self.bucket_ms)
+
+    def seen(self, mid: int, now: float = None) -> bool:
+        """Record `mid`; True if it was already recorded or is older than the window."""
+        epoch = ((mid >> 22) + discord.utils.DISCORD_EPOCH) // self.bucket_ms
+        now_epoch = int((time.time() if now is None else now) * 1000) // self.bucket_ms
+        if epoch <= now_epoch - self.buckets:
+            self.stats["stale"] += 1
+            return True
+        if self._fd is None:
+            return self._check(mid, epoch)
+        self._flock(self._fd, self._lock_ex)
+        try:
+            return self._check(mid, epoch)
+        finally:
+            self._flock(self._fd, self._unlock)
+
+    def _check(self, mid: int, epoch: int) -> bool:
+        ids = self._ids
+        base = self.HEADER + (epoch % self.buckets) * self.ring
+        ring_epoch = ids[base]
+        if ring_epoch != epoch:
+            if ring_epoch > epoch:
+                # This slot already moved on to a newer interval
+                self.stats["stale"] += 1
+                return True
+            ids[base:base + self.ring] = array("Q", bytes(8 * self.ring))
+            ids[base] = epoch
+        if ids[base + 1] * 2 >= self.slots:
+            # Ring full: let it through rather than evict live ids
+            self.stats["overflow"] += 1
+            return False
+        i = ((mid * 0x9E3779B97F4A7C15) >> 40) & self.mask
+        while True:
+            cur = ids[base + 2 + i]
+            if cur == mid:
+                self.stats["duplicates"] += 1
+                return True
+            if cur == 0:
+                ids[base + 2 + i] = mid
+                ids[base + 1] += 1
+                self.stats["seen"] += 1
+                return False
+            i = (i + 1) & self.mask
+
+    def memory_bytes(self) -> int:
+        return len(self._buf)
+
+processed = SnowflakeWindow(DEDUPE_WINDOW_SEC, DEDUPE_BUCKETS, DEDUPE_CAPACITY, DEDUPE_FILE)
+
+def _engaged_key(message: discord.Message) -> tuple:
     gid = message.guild.id if message.guild else 0
     cid = message.channel.id if hasattr(message.channel, "id") else 0
-    ENGAGED[(gid, cid, uid)] = time.time() + AUTO_FOLLOW_WINDOW
+    return (gid, cid)
+
+def mark_engaged(message: discord.Message, uid: int):
+    key = _engaged_key(message)
+    until = time.time() + AUTO_FOLLOW_WINDOW
+    users.set_engaged(users.get(uid), uid, key, until)
+    if shared_state:
+        shared_state.set_engaged(uid, key, until)
 
 def still_engaged(message: discord.Message, uid: int) -> bool:
-    gid = message.guild.id if message.guild else 0
-    cid = message.channel.id if hasattr(message.channel, "id") else 0
-    exp = ENGAGED.get((gid, cid, uid), 0)
-    return time.time() < exp
+    key = _engaged_key(message)
+    st = users.peek(uid)
+    if st is not None and st.engaged and time.time() < st.engaged.get(key, 0):
+        return True
+    return bool(shared_state) and time.time() < shared_state.engaged_until(uid, key)
+
+def cooldown_remaining(st: UserState, uid: int) -> float:
+    until = st.last_reply_at + REPLY_COOLDOWN_SEC
+    if shared_state:
+        until = max(until, shared_state.cooldown_until(uid))
+    return until - time.time()
+
+def note_replied(st: UserState, uid: int):
+    now = time.time()
+    users.mark_replied(st, uid, now)
+    if shared_state:
+        shared_state.set_cooldown(uid, now + REPLY_COOLDOWN_SEC)
 
 def already_processed(mid: int) -> bool:
-    if mid in _PROCESSED_IDS:
+    if processed.seen(mid):
         return True
-    _PROCESSED_IDS.add(mid)
-    _PROCESSED_ORDER.append(mid)
-    if len(_PROCESSED_ORDER) == _PROCESSED_ORDER.maxlen:
-        old = _PROCESSED_ORDER.popleft()
-        _PROCESSED_IDS.discard(old)
-    return False
+    # Another worker (or a duplicate host on this machine) got it first
+    return bool(shared_state) and not shared_state.claim_message(mid)
+
+TRAILING_PUNCT_RE = re.compile(r"[!? .]+$")
 
 def _norm_reply(s: str) -> str:
-    s = re.sub(r"\s+", " ", (s or "").strip().lower())
-    return re.sub(r"[!? .]+$", "", s)
+    # " ".join(split()) == re.sub(r"\s+", " ", ...) on stripped text
+    s = " ".join((s or "").lower().split())
+    return TRAILING_PUNCT_RE.sub("", s)
 
 MENTION_RE  = re.compile(r"<@!?(\d+)>")
 SPACE_FIX   = re.compile(r"[ \t]+\n")
 MULTISPACE  = re.compile(r"\s{2,}")
+UNICODE_EMOJI_RE = re.compile(r"[\U0001F300-\U0001FAFF\u2600-\u26FF]")
+SENTENCE_END_RE  = re.compile(r"(?<=[.!?])\s+")
+MD_DROP_RE       = re.compile(r"[*_#>`~|-]+")
 
 def clamp_human(text: str) -> str:
     if not text:
         return "Main yahin hoon—batao na, mood kaisa chal raha hai. "
-    text = SPACE_FIX.sub("\n", text).strip()
-    text = MULTISPACE.sub(" ", text)
-    text = re.sub(r"[*_#>`~|-]+", "", text)
-
-    # limit emojis to 1
-    emojis = re.findall(r"[\U0001F300-\U0001FAFF\u2600-\u26FF]", text)
-    if len(emojis) > 1:
-        first = emojis[0]
-        text = re.sub(r"[\U0001F300-\U0001FAFF\u2600-\u26FF]", "", text).strip()
-        text = (text + " " + first).strip()
-
-    parts = re.split(r"(?<=[.!?])\s+", text)
+    if "\n" in text:
+        text = SPACE_FIX.sub("\n", text)
+    text = MULTISPACE.sub(" ", text.strip())
+    text = MD_DROP_RE.sub("", text)
+
+    # limit emojis to 1 (pure-ASCII text has none)
+    if not text.isascii():
+        first = UNICODE_EMOJI_RE.search(text)
+        if first and UNICODE_EMOJI_RE.search(text, first.end()):
+            text = UNICODE_EMOJI_RE.sub("", text).strip()
+            text = (text + " " + first.group(0)).strip()
+
+    parts = SENTENCE_END_RE.split(text)
     parts = [p.strip() for p in parts if p.strip()]
     if not parts:
         parts = [text.strip()]
@@ -201,22 +1485,166 @@ def build_format_contract(user_text: str) -> str:
         f"User: {user_text[:500]}"
     )
 
-async def safe_send(channel: discord.abc.Messageable, text: str):
-    text = text[:MAX_DISCORD_MSG]
-    try:
-        return await channel.send(text)
-    except HTTPException as e:
-        if e.status == 429:
-            await asyncio.sleep(4)
-            return await channel.send(text[:1500])
+# =============================
+# Outbound sends (per-channel queues, rate-limit aware)
+# =============================
+class OutboundItem:
+    __slots__ = ("text", "typing_for", "enqueued", "future")
+
+    def __init__(self, text: str, typing_for: float, future: asyncio.Future):
+        self.text = text
+        self.typing_for = typing_for
+        self.enqueued = time.monotonic()
+        self.future = future
+
+class ChannelSender:
+    """Ordered outbound queue for one channel, one send in flight.
+
+    Lower priority numbers go first (DMs and mentions are 0), FIFO within a
+    priority. A 429 pauses the channel for Discord's retry_after and the same
+    item is retried; time spent queued counts towards the typing delay.
+    """
+
+    def __init__(self, channel: discord.abc.Messageable):
+        self.channel = channel
+        self.queue = []  # heap of (priority, seq, OutboundItem)
+        self.paused_until = 0.0
+        self._task = None
+
+    def submit(self, text: str, priority: int, typing_for: float = 0.0) -> asyncio.Future:
+        global _SEND_SEQ
+        fut = asyncio.get_running_loop().create_future()
+        _SEND_SEQ += 1
+        entry = (priority, _SEND_SEQ, OutboundItem(text[:MAX_DISCORD_MSG], typing_for, fut))
+        if len(self.queue) >= SEND_QUEUE_MAX:
+            worst = max(self.queue)
+            if entry > worst:
+                worst = entry
+            else:
+                self.queue.remove(worst)
+                heapq.heapify(self.queue)
+            C_SEND_DROPPED.inc("queue_full")
+            worst[2].future.set_result(None)
+            if worst is entry:
+                return fut
+        heapq.heappush(self.queue, entry)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return fut
+
+    def _take(self):
+        priority, _, item = heapq.heappop(self.queue)
+        items = [item]
+        if SEND_MERGE:
+            size = len(item.text)
+            while self.queue and self.queue[0][0] == priority and size + 1 + len(self.queue[0][2].text) <= MAX_DISCORD_MSG:
+                nxt = heapq.heappop(self.queue)[2]
+                size += 1 + len(nxt.text)
+                items.append(nxt)
+            if len(items) > 1:
+                C_SEND_MERGED.inc(n=len(items) - 1)
+        return items
+
+    async def _run(self):
+        try:
+            while self.queue:
+                items = self._take()
+                first = items[0]
+                typing_left = first.typing_for - (time.monotonic() - first.enqueued)
+                if typing_left > 0:
+                    asyncio.ensure_future(_typing_once(self.channel))
+                    await asyncio.sleep(typing_left)
+                text = "\n".join(i.text for i in items)
+                msg = await self._send(text, items)
+                for i in items:
+                    if not i.future.done():
+                        i.future.set_result(msg)
+        finally:
+            if not self.queue and senders.get(getattr(self.channel, "id", None)) is self:
+                del senders[self.channel.id]
+
+    async def _send(self, text: str, items):
+        for attempt in range(SEND_RETRIES + 1):
+            wait = max(self.paused_until, _SEND_PAUSED_UNTIL) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            now = time.monotonic()
+            for i in items:
+                H_SEND_WAIT.observe(now - i.enqueued)
+            started = time.perf_counter()
+            try:
+                return await self.channel.send(text)
+            except HTTPException as e:
+                if e.status == 429:
+                    C_SEND_429.inc()
+                    self._pause(_retry_after(e), e)
+                elif e.status >= 500:
+                    self.paused_until = time.monotonic() + min(8.0, 0.5 * 2 ** attempt)
+                else:
+                    send_log.warning("send failed: %s", e, extra={"channel": getattr(self.channel, "id", None)})
+                    C_SEND_DROPPED.inc(f"http_{e.status}")
+                    return None
+            except Exception as e:
+                send_log.warning("send failed: %r", e, extra={"channel": getattr(self.channel, "id", None)})
+                C_SEND_DROPPED.inc("error")
+                return None
+            finally:
+                H_SEND.since(started)
+        send_log.warning("send dropped after %d retries", SEND_RETRIES, extra={"channel": getattr(self.channel, "id", None)})
+        C_SEND_DROPPED.inc("retries")
+        return None
+
+    def _pause(self, retry_after: float, e: HTTPException):
+        global _SEND_PAUSED_UNTIL
+        until = time.monotonic() + retry_after
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        if headers.get("X-RateLimit-Global"):
+            _SEND_PAUSED_UNTIL = max(_SEND_PAUSED_UNTIL, until)
         else:
-            print("[SEND ERROR]", e)
+            self.paused_until = max(self.paused_until, until)
+
+def _retry_after(e: HTTPException) -> float:
+    retry_after = getattr(e, "retry_after", None)
+    if retry_after is None:
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        try:
+            retry_after = float(headers.get("Retry-After", ""))
+        except ValueError:
+            retry_after = None
+    return retry_after if retry_after and retry_after > 0 else 4.0
+
+async def _typing_once(channel):
+    # One typing POST (shows ~10 s); never holds up the send
+    try:
+        async with channel.typing():
+            pass
+    except Exception:
+        pass
+
+senders = {}  # channel_id -> ChannelSender (dropped when idle)
+_SEND_SEQ = 0
+_SEND_PAUSED_UNTIL = 0.0  # global rate limit
+
+def send_priority(message: discord.Message) -> int:
+    if isinstance(message.channel, discord.DMChannel) or client.user in getattr(message, "mentions", []):
+        return 0
+    return 1
+
+def queue_send(channel: discord.abc.Messageable, text: str, priority: int = 1, typing_for: float = 0.0) -> asyncio.Future:
+    sender = senders.get(channel.id)
+    if sender is None:
+        sender = senders[channel.id] = ChannelSender(channel)
+    return sender.submit(text, priority, typing_for)
+
+async def safe_send(channel: discord.abc.Messageable, text: str, priority: int = 1):
+    """Queue a message and wait until it is sent (or dropped -> None)."""
+    return await queue_send(channel, text, priority)
 
 async def type_and_send(message: discord.Message, text: str):
+    """Queue a reply behind a short typing indicator; returns without waiting."""
     part = text.strip()
-    async with message.channel.typing():
-        await asyncio.sleep(min(1.2, 0.35 + 0.22 * len(part) / 80))
-    return await safe_send(message.channel, f"{message.author.mention} {part}")
+    return queue_send(message.channel, f"{message.author.mention} {part}", send_priority(message),
+                      typing_for=min(1.2, 0.35 + 0.22 * len(part) / 80))
 
 # =============================
 # TTS sanitization (won't read code/mentions/links/YAML)
@@ -226,7 +1654,7 @@ ROLE_TAG_RE      = re.compile(r"<@&[0-9]+>")
 CHANNEL_TAG_RE   = re.compile(r"<#[0-9]+>")
 TIMESTAMP_TAG_RE = re.compile(r"<t:[0-9]+(?::[a-zA-Z])?>")
 CUSTOM_EMOJI_RE  = re.compile(r"<a?:[^:>]+:\d+>")
-UNICODE_EMOJI_RE = re.compile(r"[\U0001F300-\U0001FAFF\u2600-\u26FF]")
+TAG_RES          = (MENTION_TAG_RE, ROLE_TAG_RE, CHANNEL_TAG_RE, TIMESTAMP_TAG_RE, CUSTOM_EMOJI_RE)
 
 URL_RE         = re.compile(r"https?://\S+")
 MD_LINK_RE     = re.compile(r"\[([^\]]+)\]\([^)]+\)")
@@ -237,21 +1665,31 @@ INLINE_CODE_RE = re.compile(r"`[^`]*`")
 YAML_KEYLINE_RE = re.compile(
     r"(?m)^[ \t\-]*[A-Za-z0-9_.-]+:\s*(?:\"[^\"]*\"|'[^']*'|[^#\n]*)$"
 )
+HARD_FLAG_RE = re.compile(r"(?i)\b(render\.yaml|dockerfile|services:|envVars:|FROM |WORKDIR |CMD )")
+# Markdown symbols -> space and space/tab collapse in one pass: any run of
+# symbols and non-newline whitespace ends up as a single space either way.
+MD_HSPACE_RE = re.compile(r"(?:[*_~`|>]|[^\S\r\n])+")
+CODE_SYMS    = "{}[]:/\\=;|@"
 
 def strip_mentions_links_code(s: str) -> str:
     """Remove code fences, inline code, links, mentions, emojis — PRESERVE newlines for YAML filtering."""
-    # Remove big blocks but keep line breaks
-    s = CODE_FENCE_RE.sub("\n", s)
-    s = INLINE_CODE_RE.sub(" ", s)
-    s = URL_RE.sub(" ", s)
-    s = MD_LINK_RE.sub(r"\1", s)
-    for rx in (MENTION_TAG_RE, ROLE_TAG_RE, CHANNEL_TAG_RE, TIMESTAMP_TAG_RE, CUSTOM_EMOJI_RE):
-        s = rx.sub(" ", s)
-    s = UNICODE_EMOJI_RE.sub(" ", s)
-    # Clean markdown symbols but KEEP \n
-    s = re.sub(r"[*_~`|>]+", " ", s)
-    # Collapse spaces/tabs but not newlines
-    s = re.sub(r"[^\S\r\n]+", " ", s)
+    # Each pass only runs if its trigger text is present; passes never add triggers
+    if "`" in s:
+        # Remove big blocks but keep line breaks
+        if "```" in s:
+            s = CODE_FENCE_RE.sub("\n", s)
+        s = INLINE_CODE_RE.sub(" ", s)
+    if "http" in s:
+        s = URL_RE.sub(" ", s)
+    if "](" in s:
+        s = MD_LINK_RE.sub(r"\1", s)
+    if "<" in s:
+        for rx in TAG_RES:
+            s = rx.sub(" ", s)
+    if not s.isascii():
+        s = UNICODE_EMOJI_RE.sub(" ", s)
+    # Clean markdown symbols and collapse spaces/tabs, but KEEP \n
+    s = MD_HSPACE_RE.sub(" ", s)
     return s.strip()
 
 # Hinglish fixes (roman -> Devanagari for better Hindi voice)
@@ -268,15 +1706,70 @@ HINGLISH_MAP = {
     "booyah": "बूया",
 }
 
-def improve_hinglish(text: str) -> str:
-    def repl(m):
+def _load_hinglish_file(path: str) -> dict:
+    """Extra entries from a JSON object or a TSV file (roman<TAB>devanagari per line)."""
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".json"):
+                return dict(json.load(f))
+            out = {}
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and "\t" in line:
+                    roman, deva = line.split("\t", 1)
+                    out[roman.strip()] = deva.strip()
+            return out
+    except Exception as e:
+        log.error("hinglish dict %s unreadable: %s", path, e)
+        return {}
+
+def _trie_pattern(words) -> str:
+    """Regex shaped like a trie of the words, so lookup cost doesn't grow with dictionary size."""
+    root = {}
+    for w in words:
+        node = root
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        alts = [f"[{ch}{ch.upper()}]" + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return r"\b" + build(root) + r"\b"
+
+class HinglishTransliterator:
+    """Whole-word roman -> Devanagari replacement.
+
+    A word is a whole \\b[a-zA-Z]+\\b token, looked up lowercased. The
+    regex is a trie of the dictionary, so it only stops on dictionary words
+    instead of calling back for every word in the text.
+    """
+
+    def __init__(self, mapping: dict):
+        # Only all-lowercase ASCII keys can ever equal a lowercased token
+        self.map = {k: v for k, v in mapping.items() if k.isascii() and k.isalpha() and k == k.lower()}
+        self._rx = re.compile(_trie_pattern(self.map)) if self.map else None
+
+    def _repl(self, m) -> str:
         w = m.group(0)
-        key = w.lower()
-        fixed = HINGLISH_MAP.get(key)
-        if fixed and w[0].isupper():
-            return fixed
-        return fixed or w
-    return re.sub(r"\b[a-zA-Z]+\b", repl, text)
+        return self.map.get(w.lower()) or w
+
+    def __call__(self, text: str) -> str:
+        if self._rx is None:
+            return text
+        return self._rx.sub(self._repl, text)
+
+HINGLISH_MAP.update(_load_hinglish_file(HINGLISH_DICT_FILE))
+_hinglish = HinglishTransliterator(HINGLISH_MAP)
+
+def improve_hinglish(text: str) -> str:
+    return _hinglish(text)
 
 def get_speakable_text(text: str) -> str:
     """
@@ -289,21 +1782,22 @@ def get_speakable_text(text: str) -> str:
     original = text or ""
 
     # Early hard flags → summarize
-    if "```" in original or re.search(r"(?i)\b(render\.yaml|dockerfile|services:|envVars:|FROM |WORKDIR |CMD )", original):
+    if "```" in original or HARD_FLAG_RE.search(original):
         return CODE_SUMMARY_LINE
 
     # Step 1: strip but keep line breaks
     s = strip_mentions_links_code(original)
 
     # Step 2: drop YAML-looking lines while \n are intact
-    yaml_lines = YAML_KEYLINE_RE.findall(s)
-    s = YAML_KEYLINE_RE.sub(" ", s)
+    yaml_lines = 0
+    if ":" in s:
+        s, yaml_lines = YAML_KEYLINE_RE.subn(" ", s)
 
     # Step 3: now collapse whitespace (including \n)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = " ".join(s.split())
 
     # Step 4: code-ish heuristic
-    sym_ratio = (sum(c in "{}[]:/\\=;|@" for c in s) / max(1, len(s))) if s else 1.0
+    sym_ratio = (sum(map(s.count, CODE_SYMS)) / max(1, len(s))) if s else 1.0
     removed_many = bool(yaml_lines)
     if (not s) or sym_ratio > 0.08 or removed_many:
         return CODE_SUMMARY_LINE
@@ -318,13 +1812,15 @@ def xml_escape(s: str) -> str:
     return html.escape(s, quote=True)
 
 # Name cleanup (skip emoji names etc.)
+NAME_JUNK_RE = re.compile(r"[^A-Za-z0-9 ._-]")
+
 def clean_display_name(name: str) -> str:
     if not name:
         return ""
-    name = re.sub(r"<a?:[^:>]+:\d+>", "", name)      # custom emoji
-    name = re.sub(r"[\U0001F300-\U0001FAFF\u2600-\u26FF]", "", name)  # unicode emoji
-    name = re.sub(r"[^A-Za-z0-9 ._-]", "", name).strip()
-    name = re.sub(r"\s{2,}", " ", name)
+    name = CUSTOM_EMOJI_RE.sub("", name)      # custom emoji
+    name = UNICODE_EMOJI_RE.sub("", name)     # unicode emoji
+    name = NAME_JUNK_RE.sub("", name).strip()
+    name = MULTISPACE.sub(" ", name)
     return name if len(name) >= 2 else ""
 
 # =============================
@@ -333,7 +1829,7 @@ def clean_display_name(name: str) -> str:
 async def join_user_channel(message: discord.Message):
     if getattr(message.author, "voice", None) and message.author.voice and message.author.voice.channel:
         channel = message.author.voice.channel
-        vc = discord.utils.get(client.voice_clients, guild=message.guild)
+        vc = get_voice_client(message.guild)
         if vc and vc.channel == channel:
             return vc
         if vc and vc.is_connected():
@@ -342,7 +1838,7 @@ async def join_user_channel(message: discord.Message):
         try:
             return await channel.connect()
         except Exception as e:
-            print("[VC CONNECT ERROR]", e)
+            tts_log.warning("voice connect failed: %s", e, extra=log_fields(message))
             await safe_send(message.channel, "Voice channel join failed. Kya mujhe Connect/Speak permission mila hai?")
             return None
     else:
@@ -350,7 +1846,10 @@ async def join_user_channel(message: discord.Message):
         return None
 
 async def leave_vc(guild: discord.Guild):
-    vc = discord.utils.get(client.voice_clients, guild=guild)
+    speaker = speakers.pop(guild.id, None) if guild else None
+    if speaker:
+        speaker.clear()
+    vc = get_voice_client(guild)
     if vc and vc.is_connected():
         await vc.disconnect(force=True)
 
@@ -370,64 +1869,1014 @@ def make_ssML(speakable_text: str, disp_name: str) -> str:
   </voice>
 </speak>"""
 
-async def speak_in_vc(guild: discord.Guild, text: str, display_name: str):
-    if not ENABLE_TTS:
+# =============================
+# TTS audio cache (content-addressed, LRU on disk)
+# =============================
+class TTSCache:
+    """Audio files keyed by sha256 of the final SSML + voice params, evicted LRU by size/count."""
+
+    def __init__(self, root: str, max_bytes: int, max_entries: int, suffix: str = ".mp3"):
+        self.root = pathlib.Path(root)
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._index = OrderedDict()  # key -> size in bytes, oldest first
+        self._bytes = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key_for(*parts: str) -> str:
+        """Backend name, engine input and every voice setting that changes the audio."""
+        raw = "\x1f".join(parts)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / f"{key}{self.suffix}"
+
+    def _load(self):
+        # Leftovers from writes interrupted by a restart
+        for p in self.root.glob("*.tmp"):
+            p.unlink(missing_ok=True)
+        files = []
+        for p in self.root.glob(f"*{self.suffix}"):
+            st = p.stat()
+            files.append((st.st_mtime, p.stem, st.st_size))
+        for _, key, size in sorted(files):
+            self._index[key] = size
+            self._bytes += size
+        self._evict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def get(self, key: str):
+        size = self._index.get(key)
+        path = self._path(key)
+        if size is None or not path.exists():
+            if size is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._index.move_to_end(key)
+        try:
+            os.utime(path)  # keep LRU order across restarts
+        except OSError:
+            pass
+        self.hits += 1
+        return str(path)
+
+    def new_tmp(self) -> str:
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        os.close(fd)
+        return tmp
+
+    def commit(self, key: str, tmp: str) -> str:
+        """Atomically move a finished temp file into place."""
+        size = os.path.getsize(tmp)
+        if size == 0:
+            os.unlink(tmp)
+            raise RuntimeError("TTS produced no audio")
+        path = self._path(key)
+        os.replace(tmp, path)
+        if key in self._index:
+            self._bytes -= self._index.pop(key)
+        self._index[key] = size
+        self._bytes += size
+        self._evict()
+        return str(path)
+
+    def _drop(self, key: str):
+        self._bytes -= self._index.pop(key, 0)
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone is over budget
+        while len(self._index) > 1 and (len(self._index) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._index))
+            self._drop(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._index),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+tts_cache = TTSCache(TTS_CACHE_DIR, int(TTS_CACHE_MAX_MB * 1024 * 1024), TTS_CACHE_MAX_ENTRIES)
+# Ogg Opus twins of the cached clips (same keys), played with codec copy
+opus_cache = TTSCache(os.path.join(TTS_CACHE_DIR, "opus"), int(OPUS_CACHE_MAX_MB * 1024 * 1024),
+                      TTS_CACHE_MAX_ENTRIES, suffix=".opus")
+_OPUS_INFLIGHT = {}  # key -> asyncio.Task
+_OPUS_SEM = asyncio.Semaphore(1)  # background transcodes, one at a time
+_PLAYED_ONCE = OrderedDict()  # keys heard once; most replies are never repeated
+
+# =============================
+# TTS backends (remote edge-tts, local espeak-ng/piper)
+# =============================
+class TTSBackend:
+    """One TTS engine: synthesize() a file, stream() chunks, warm() ahead of use.
+
+    Each backend owns its clip cache and runs at most `workers` syntheses at
+    once; extra lines wait for a slot instead of piling onto the engine.
+    """
+
+    name = ""
+    ffmpeg_input = ""  # FFmpeg input options for this engine's output format
+
+    def __init__(self, cache: TTSCache, workers: int):
+        self.cache = cache
+        self.slots = asyncio.Semaphore(max(1, workers))
+        self.inflight = {}  # key -> asyncio.Task (same line requested twice at once)
+
+    def render(self, speakable: str, disp_name: str) -> str:
+        """Engine input for a cleaned line (SSML, plain text...)."""
+        raise NotImplementedError
+
+    def key(self, text: str) -> str:
+        raise NotImplementedError
+
+    async def _stream(self, text: str):
+        raise NotImplementedError
+        yield b""
+
+    async def stream(self, text: str):
+        """Yield raw audio chunks as the engine produces them."""
+        async with self.slots:
+            async for data in self._stream(text):
+                yield data
+
+    async def synthesize(self, text: str, path: str):
+        async with self.slots:
+            with open(path, "wb") as f:
+                async for data in self._stream(text):
+                    f.write(data)
+
+    async def warm(self):
+        pass
+
+class _KeepOpenConnector(aiohttp.TCPConnector):
+    # edge-tts closes its session's connector after every line; keep ours
+    # (and its DNS cache) for the life of the process instead.
+    def close(self, **kwargs):
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(None)
+        return fut
+
+class EdgeTTSBackend(TTSBackend):
+    """Microsoft neural voices via edge-tts (VOICE_NAME / !setvoice).
+
+    The service takes one websocket per line, so only the connector and its
+    DNS cache are reused between lines.
+    """
+
+    name = "edge"
+
+    def __init__(self, cache: TTSCache, workers: int):
+        super().__init__(cache, workers)
+        self._connector = None
+
+    def render(self, speakable: str, disp_name: str) -> str:
+        return make_ssML(speakable, disp_name)
+
+    def key(self, text: str) -> str:
+        return TTSCache.key_for(self.name, text, VOICE_NAME, VOICE_RATE, VOICE_PITCH, VOICE_STYLE)
+
+    def _connector_now(self):
+        if self._connector is None or self._connector.closed:
+            self._connector = _KeepOpenConnector(ttl_dns_cache=300)
+        return self._connector
+
+    async def _stream(self, text: str):
+        import edge_tts
+        comm = edge_tts.Communicate(text, VOICE_NAME, connector=self._connector_now())
+        async for chunk in comm.stream():
+            if chunk.get("type") == "audio" and chunk.get("data"):
+                yield chunk["data"]
+
+    async def warm(self):
+        import edge_tts  # noqa: F401  (first import is slow; do it off the reply path)
+        self._connector_now()
+
+class LocalTTSBackend(TTSBackend):
+    """Offline engine run per line: text on stdin, audio on stdout.
+
+    LOCAL_TTS_CMD defaults to espeak-ng (WAV out); for piper use e.g.
+    "piper -m voice.onnx --output-raw" with LOCAL_TTS_INPUT="-f s16le -ar 22050 -ac 1".
+    """
+
+    name = "local"
+
+    def __init__(self, cache: TTSCache, workers: int):
+        super().__init__(cache, workers)
+        self.ffmpeg_input = LOCAL_TTS_INPUT
+
+    def render(self, speakable: str, disp_name: str) -> str:
+        spoken_name = clean_display_name(disp_name) if ENABLE_READ_NAME else ""
+        return f"{spoken_name}, {speakable}" if spoken_name else speakable
+
+    def key(self, text: str) -> str:
+        return TTSCache.key_for(self.name, text, LOCAL_TTS_CMD, LOCAL_TTS_INPUT)
+
+    async def _stream(self, text: str):
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(LOCAL_TTS_CMD),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        try:
+            proc.stdin.write(text.encode("utf-8"))
+            proc.stdin.close()
+            while True:
+                data = await proc.stdout.read(16384)
+                if not data:
+                    break
+                yield data
+            err = await proc.stderr.read()
+            if await proc.wait() != 0:
+                raise RuntimeError(f"{LOCAL_TTS_CMD.split()[0]} exited {proc.returncode}: "
+                                   f"{err.decode(errors='replace').strip()[:200]}")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+    async def warm(self):
+        # Loads the binary and voice data into the page cache; fails loudly if missing
+        async for _ in self._stream("ok"):
+            pass
+
+tts_backends = {
+    "edge": EdgeTTSBackend(tts_cache, TTS_WORKERS),
+    "local": LocalTTSBackend(
+        TTSCache(os.path.join(TTS_CACHE_DIR, "local"), int(LOCAL_TTS_CACHE_MAX_MB * 1024 * 1024),
+                 TTS_CACHE_MAX_ENTRIES, suffix=".audio"),
+        TTS_WORKERS,
+    ),
+}
+guild_tts = {}  # guild_id -> backend name picked with !voicemode
+
+def backend_for(guild) -> TTSBackend:
+    name = guild_tts.get(guild.id) if guild is not None else None
+    return tts_backends.get(name or TTS_BACKEND) or tts_backends["edge"]
+
+async def synthesize_cached(text: str, backend: TTSBackend) -> str:
+    key = backend.key(text)
+    path = backend.cache.get(key)
+    if path:
+        return path
+    task = backend.inflight.get(key)
+    if task is None:
+        async def run():
+            tmp = backend.cache.new_tmp()
+            try:
+                await backend.synthesize(text, tmp)
+                return backend.cache.commit(key, tmp)
+            except BaseException:
+                pathlib.Path(tmp).unlink(missing_ok=True)
+                raise
+            finally:
+                backend.inflight.pop(key, None)
+        task = backend.inflight[key] = asyncio.ensure_future(run())
+    return await asyncio.shield(task)
+
+class AudioChunkPipe:
+    """Blocking file-like object fed from the event loop.
+
+    discord.py's FFmpeg pipe writer thread calls read() and forwards the bytes
+    to FFmpeg's stdin; an empty read() means end of stream.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def feed(self, data: bytes):
+        with self._cond:
+            self._buf += data
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, n: int = -1) -> bytes:
+        with self._cond:
+            while not self._buf and not self._closed:
+                self._cond.wait()
+            if n is None or n < 0:
+                n = len(self._buf)
+            out = bytes(self._buf[:n])
+            del self._buf[:n]
+            return out
+
+async def _pump_stream(stream, pipe: AudioChunkPipe, key: str, first: bytes, backend: TTSBackend):
+    # Feed the rest of the stream, then keep a copy in the cache for next time
+    chunks = [first]
+    try:
+        async for data in stream:
+            pipe.feed(data)
+            chunks.append(data)
+        tmp = backend.cache.new_tmp()
+        try:
+            with open(tmp, "wb") as f:
+                f.write(b"".join(chunks))
+            backend.cache.commit(key, tmp)
+        except Exception:
+            pathlib.Path(tmp).unlink(missing_ok=True)
+            raise
+    except Exception as e:
+        tts_log.warning("tts stream failed: %r", e)
+    finally:
+        pipe.close()
+
+async def open_tts_audio(text: str, backend: TTSBackend):
+    """Return a cached/synthesized file path, or an AudioChunkPipe that is still being fed."""
+    if ENABLE_TTS_STREAM:
+        key = backend.key(text)
+        path = backend.cache.get(key)
+        if path:
+            return path
+        stream = backend.stream(text)
+        try:
+            first = await stream.__anext__()
+        except Exception as e:
+            # Nothing played yet, so the file-based path can still take over
+            await stream.aclose()
+            tts_log.info("tts stream unavailable, synthesizing to file: %r", e)
+        else:
+            pipe = AudioChunkPipe()
+            pipe.feed(first)
+            asyncio.ensure_future(_pump_stream(stream, pipe, key, first, backend))
+            return pipe
+    return await synthesize_cached(text, backend)
+
+async def _transcode_opus(src: str, dst: str, input_opts: str = ""):
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-y", *shlex.split(input_opts), "-i", src,
+        "-map_metadata", "-1", "-vn", "-c:a", "libopus", "-b:a", f"{OPUS_BITRATE_KBPS}k",
+        "-ar", "48000", "-ac", "2", "-f", "ogg", dst,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    _, err = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited {proc.returncode}: {err.decode(errors='replace').strip()[:200]}")
+
+async def opus_clip(key: str, src_path: str, backend: TTSBackend) -> str:
+    """Ogg Opus copy of a cached clip, transcoded once and kept in opus_cache."""
+    if key in opus_cache:
+        path = opus_cache.get(key)
+        if path:
+            return path
+    task = _OPUS_INFLIGHT.get(key)
+    if task is None:
+        async def run():
+            tmp = opus_cache.new_tmp()
+            try:
+                async with _OPUS_SEM:
+                    await _transcode_opus(src_path, tmp, backend.ffmpeg_input)
+                return opus_cache.commit(key, tmp)
+            except BaseException:
+                pathlib.Path(tmp).unlink(missing_ok=True)
+                raise
+            finally:
+                _OPUS_INFLIGHT.pop(key, None)
+        task = _OPUS_INFLIGHT[key] = asyncio.ensure_future(run())
+    return await asyncio.shield(task)
+
+def schedule_opus(key: str, src_path: str, backend: TTSBackend):
+    if key in opus_cache or key in _OPUS_INFLIGHT:
         return
-    vc = discord.utils.get(client.voice_clients, guild=guild)
-    if not vc or not vc.is_connected():
+    def done(t):
+        if not t.cancelled() and t.exception():
+            tts_log.warning("opus transcode failed: %s", t.exception())
+    asyncio.ensure_future(opus_clip(key, src_path, backend)).add_done_callback(done)
+
+def _played_again(key: str) -> bool:
+    """True from a line's second play on; only repeats earn an Opus copy."""
+    if key in _PLAYED_ONCE:
+        del _PLAYED_ONCE[key]
+        return True
+    _PLAYED_ONCE[key] = None
+    while len(_PLAYED_ONCE) > TTS_CACHE_MAX_ENTRIES:
+        _PLAYED_ONCE.popitem(last=False)
+    return False
+
+def voice_source(audio, key: str, backend: TTSBackend) -> discord.AudioSource:
+    """FFmpeg source for a cached path or a live AudioChunkPipe."""
+    pipe = isinstance(audio, AudioChunkPipe)
+    before = backend.ffmpeg_input or None
+    if VOICE_CODEC != "opus":
+        return discord.FFmpegPCMAudio(audio, pipe=pipe, before_options=before, options="-vn")
+    if _played_again(key) and not pipe:
+        schedule_opus(key, audio, backend)  # from the next play on, codec copy
+    # FFmpeg encodes Opus itself; discord.py only forwards the packets
+    return discord.FFmpegOpusAudio(audio, pipe=pipe, bitrate=OPUS_BITRATE_KBPS,
+                                   before_options=before, options="-vn")
+
+async def prewarm_clips(names=("",), backend: TTSBackend = None):
+    """Warm the engine, then synthesize and pre-encode the fixed VC lines.
+
+    The acks are spoken without a name, so they're done once; the code-block
+    line can open a reply, so it's done per name in `names`.
+    """
+    backend = backend or backend_for(None)
+    try:
+        await backend.warm()
+    except Exception as e:
+        tts_log.warning("%s backend warm-up failed: %r", backend.name, e)
         return
+    seen = set()
+    lines = [(line, "") for line in VOICE_ACKS.values()] + [(CODE_SUMMARY_LINE, name) for name in names]
+    for line, name in lines:
+        text = backend.render(get_speakable_text(line), name)
+        key = backend.key(text)
+        if key in seen or (key in backend.cache and (VOICE_CODEC != "opus" or key in opus_cache)):
+            continue
+        seen.add(key)
+        try:
+            path = await synthesize_cached(text, backend)
+            if VOICE_CODEC == "opus":
+                await opus_clip(key, path, backend)
+        except Exception as e:
+            tts_log.warning("prewarm failed: %r", e)
+            return
+
+# =============================
+# Per-guild playback queue (synthesize ahead, play in order)
+# =============================
+class SpeechItem:
+    """One reply to speak; its lines play back to back, never split by other users.
+
+    A streamed reply is queued `open` with its first sentence and gets the
+    rest through add() as the model writes them; close() when it's done.
+    """
+    __slots__ = ("user_id", "lines", "display_name", "open", "_more")
+
+    def __init__(self, user_id: int, text: str, display_name: str, open: bool = False):
+        self.user_id = user_id
+        self.lines = deque([text])
+        self.display_name = display_name  # spoken with the first line only
+        self.open = open
+        self._more = asyncio.Event()
+
+    def add(self, text: str):
+        self.lines.append(text)
+        self._more.set()
+
+    def close(self):
+        self.open = False
+        self._more.set()
+
+    async def wait_more(self, timeout: float):
+        self._more.clear()
+        try:
+            await asyncio.wait_for(self._more.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.open = False  # the stream never closed it; don't hold the queue
+
+class GuildSpeaker:
+    """Queue of replies waiting to be spoken in one guild's VC.
+
+    Users are served round-robin so one chatty person can't starve the rest;
+    a reply's lines always play together. The next line is synthesized while
+    the current one plays, and completion comes from the player's after=
+    callback instead of polling.
+    """
+
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self.pending = OrderedDict()  # user_id -> deque[SpeechItem], in round-robin order
+        self.depth = 0
+        self._current = None  # reply being spoken; its remaining lines go first
+        self._task = None
+
+    def enqueue(self, item: SpeechItem):
+        q = self.pending.get(item.user_id)
+        if VC_QUEUE_POLICY == "merge" and q and not q[-1].open and not item.open:
+            last = q[-1]
+            last.lines[-1] = " ".join((last.lines[-1], *item.lines))
+            C_VC_QUEUE.inc("merged")
+        else:
+            while self.depth >= VC_QUEUE_MAX:
+                self._drop_oldest()
+            self.pending.setdefault(item.user_id, deque()).append(item)
+            self.depth += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def clear(self):
+        self.pending.clear()
+        self.depth = 0
+        self._current = None
+
+    def _drop_oldest(self):
+        # The user at the front of the rotation has the longest-waiting line
+        uid, q = next(iter(self.pending.items()))
+        q.popleft()
+        if not q:
+            del self.pending[uid]
+        self.depth -= 1
+        C_VC_QUEUE.inc("dropped")
+
+    def _pop(self):
+        if not self.pending:
+            return None
+        uid, q = self.pending.popitem(last=False)
+        item = q.popleft()
+        if q:
+            self.pending[uid] = q  # back of the rotation
+        self.depth -= 1
+        return item
+
+    def _has_work(self) -> bool:
+        cur = self._current
+        return bool(self.pending) or (cur is not None and (bool(cur.lines) or cur.open))
+
+    async def _next_line(self):
+        """(item, text, name) to play next: the rest of the current reply first."""
+        while True:
+            item = self._current
+            if item is None:
+                item = self._current = self._pop()
+                if item is None:
+                    return None
+            if item.lines:
+                name, item.display_name = item.display_name, ""
+                return item, item.lines.popleft(), name
+            if not item.open:
+                self._current = None
+                continue
+            # Sentence 2 is still being written; nobody else cuts in meanwhile
+            await item.wait_more(MODEL_DEADLINE_SEC)
+            if self._current is not item:  # cleared while waiting
+                return None
+
+    async def _prepare_next(self):
+        found = await self._next_line()
+        if found is None:
+            return None
+        return await self._prepare(*found)
+
+    async def _prepare(self, item: SpeechItem, line: str, display_name: str) -> discord.AudioSource:
+        backend = backend_for(self.guild)
+        speakable = get_speakable_text(line)
+        if tts_log.isEnabledFor(logging.DEBUG):
+            tts_log.debug("speakable [%s] %s %s", backend.name, speakable, backend.cache.stats(),
+                          extra=log_fields(guild=self.guild, user=item.user_id))
+        text = backend.render(speakable, display_name)
+        key = backend.key(text)
+        started = time.perf_counter()
+        if VOICE_CODEC == "opus" and key in opus_cache:
+            path = opus_cache.get(key)
+            if path:
+                H_TTS_SYNTH.since(started)
+                return discord.FFmpegOpusAudio(path, codec="copy")
+        audio = await open_tts_audio(text, backend)
+        H_TTS_SYNTH.since(started)
+        return voice_source(audio, key, backend)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        upcoming = asyncio.ensure_future(self._prepare_next())
+        while True:
+            try:
+                source = await upcoming
+            except Exception as e:
+                tts_log.warning("tts failed: %r", e, extra=log_fields(guild=self.guild))
+                upcoming = asyncio.ensure_future(self._prepare_next())
+                continue
+            if source is None:
+                # Lines may have arrived while the last one played
+                if not self._has_work():
+                    return
+                upcoming = asyncio.ensure_future(self._prepare_next())
+                continue
+            vc = get_voice_client(self.guild)
+            if not vc or not vc.is_connected():
+                source.cleanup()
+                self.clear()
+                return
+            if vc.is_playing():
+                vc.stop()
+            done = asyncio.Event()
+            started = time.perf_counter()
+
+            def after(err, done=done, started=started):
+                H_TTS_PLAY.since(started)
+                if err:
+                    tts_log.warning("playback failed: %r", err, extra=log_fields(guild=self.guild))
+                loop.call_soon_threadsafe(done.set)
+
+            try:
+                vc.play(source, after=after)
+            except Exception as e:
+                tts_log.warning("play failed: %r", e, extra=log_fields(guild=self.guild))
+                source.cleanup()
+                done.set()
+            upcoming = asyncio.ensure_future(self._prepare_next())  # synthesize ahead while this plays
+            await done.wait()
+
+speakers = {}  # guild_id -> GuildSpeaker
+
+def get_voice_client(guild):
+    if guild is None:
+        return None
+    return discord.utils.get(client.voice_clients, guild=guild)
+
+def speak_in_vc(guild: discord.Guild, text: str, display_name: str, user_id: int = 0, more: bool = False):
+    """Queue a line for the guild's VC and return immediately.
+
+    With more=True the returned SpeechItem stays open: add() the reply's next
+    sentences to it and close() it when the reply is complete.
+    """
+    if not ENABLE_TTS:
+        return None
+    vc = get_voice_client(guild)
+    if not vc or not vc.is_connected():
+        return None
+    speaker = speakers.get(guild.id)
+    if speaker is None:
+        speaker = speakers[guild.id] = GuildSpeaker(guild)
+    item = SpeechItem(user_id, text, display_name, open=more)
+    speaker.enqueue(item)
+    return item
+
+# =============================
+# Conversation memory (SQLite, token budget, rolling summary)
+# =============================
+def estimate_tokens(text: str) -> int:
+    return len(text or "") // 4 + 1
+
+SUMMARY_PROMPT = (
+    "Neeche ek user aur Disha ki purani baatein hain. Inka 2-3 line ka short summary likho "
+    "(Hinglish, third person): naam, facts, pasand/napasand, mood aur koi open topic. "
+    "Sirf summary likho.\n\n"
+)
+
+class ConversationMemory:
+    """Append-only per-user chat log with a rolling summary.
+
+    SQLite work runs on one private thread. The live ChatSession is rebuilt
+    lazily from here: FEWSHOT, then the summary, then the newest turns that
+    fit in the token budget, so the prompt size stays flat however long the
+    conversation runs, and context survives restarts.
+    """
+
+    def __init__(self, path: str, budget: int):
+        self.budget = budget
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+        self.db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, uid INTEGER NOT NULL,
+                role TEXT NOT NULL, text TEXT NOT NULL, ts REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS turns_uid ON turns (uid, id);
+            CREATE TABLE IF NOT EXISTS summaries (
+                uid INTEGER PRIMARY KEY, text TEXT NOT NULL, upto INTEGER NOT NULL);
+        """)
+        self._compacting = set()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    # --- executor thread ---
+    def _append(self, uid: int, user_text: str, reply: str):
+        now = time.time()
+        self.db.executemany("INSERT INTO turns (uid, role, text, ts) VALUES (?, ?, ?, ?)",
+                            [(uid, "user", user_text, now), (uid, "model", reply, now)])
+
+    def _load(self, uid: int):
+        row = self.db.execute("SELECT text, upto FROM summaries WHERE uid = ?", (uid,)).fetchone()
+        summary, upto = row if row else ("", 0)
+        rows = self.db.execute("SELECT id, role, text FROM turns WHERE uid = ? AND id > ? ORDER BY id",
+                               (uid, upto)).fetchall()
+        return summary, rows
+
+    def _save_summary(self, uid: int, text: str, upto: int):
+        self.db.execute("INSERT OR REPLACE INTO summaries (uid, text, upto) VALUES (?, ?, ?)", (uid, text, upto))
+        self.db.execute("DELETE FROM turns WHERE uid = ? AND id <= ?", (uid, upto))
+
+    def _forget(self, uid: int):
+        self.db.execute("DELETE FROM turns WHERE uid = ?", (uid,))
+        self.db.execute("DELETE FROM summaries WHERE uid = ?", (uid,))
+
+    def _knows(self, uid: int) -> bool:
+        return bool(self.db.execute("SELECT 1 FROM turns WHERE uid = ? UNION ALL "
+                                    "SELECT 1 FROM summaries WHERE uid = ? LIMIT 1", (uid, uid)).fetchone())
+
+    # --- async API ---
+    async def record(self, uid: int, user_text: str, reply: str):
+        await self._run(self._append, uid, user_text, reply)
+
+    async def forget(self, uid: int):
+        await self._run(self._forget, uid)
+
+    async def knows(self, uid: int) -> bool:
+        """Anything stored for this user (turns or a summary)?"""
+        return await self._run(self._knows, uid)
+
+    def _recent(self, rows, budget: int):
+        kept, used = [], 0
+        for row in reversed(rows):
+            used += estimate_tokens(row[2])
+            if used > budget:
+                break
+            kept.append(row)
+        kept.reverse()
+        # Gemini wants the history to start with a user turn
+        while kept and kept[0][1] != "user":
+            kept.pop(0)
+        return kept
+
+    async def history(self, uid: int):
+        """(history for start_chat, estimated conversation tokens in it)."""
+        summary, rows = await self._run(self._load, uid)
+        history = list(FEWSHOT)
+        tokens = 0
+        if summary:
+            history.append({"role": "user", "parts": f"(Pichli baaton ka summary: {summary})"})
+            history.append({"role": "model", "parts": "Haan, yaad hai."})
+            tokens += estimate_tokens(summary)
+        for _, role, text in self._recent(rows, self.budget // 2):
+            history.append({"role": role, "parts": text})
+            tokens += estimate_tokens(text)
+        return history, tokens
+
+    def schedule_compaction(self, uid: int):
+        if uid not in self._compacting:
+            self._compacting.add(uid)
+            asyncio.ensure_future(self._compact(uid))
+
+    async def _compact(self, uid: int):
+        try:
+            summary, rows = await self._run(self._load, uid)
+            keep = self._recent(rows, self.budget // 2)
+            older = rows[:len(rows) - len(keep)]
+            if not older:
+                return
+            text = await summarize_turns(summary, older)
+            await self._run(self._save_summary, uid, text, older[-1][0])
+            C_COMPACTIONS.inc()
+        except Exception:
+            mem_log.exception("compaction failed", extra={"user": uid})
+        finally:
+            self._compacting.discard(uid)
+
+async def summarize_turns(summary: str, rows) -> str:
+    lines = "\n".join(f"{'User' if role == 'user' else 'Disha'}: {text}" for _, role, text in rows)
+    fallback = f"{summary} {lines}".replace("\n", " ").strip()[-MEMORY_SUMMARY_CHARS:]
+    if model is None:
+        return fallback
+    prompt = SUMMARY_PROMPT + (f"Purana summary: {summary}\n\n" if summary else "") + lines
     try:
-        import edge_tts
-        tmpdir = tempfile.mkdtemp()
-        mp3_path = str(pathlib.Path(tmpdir) / "out.mp3")
-
-        speakable = get_speakable_text(text)
-        if DEBUG_TTS:
-            print("[TTS SPEAKABLE]", speakable)
-
-        ssml = make_ssML(speakable, display_name)
-        tts = edge_tts.Communicate(ssml, VOICE_NAME)
-        await tts.save(mp3_path)
-
-        if vc.is_playing():
-            vc.stop()
-        source = discord.FFmpegPCMAudio(mp3_path, options="-vn")
-        vc.play(source)
-        while vc.is_playing():
-            await asyncio.sleep(0.2)
+        resp = await model_client.send(model.start_chat(history=[]), prompt)
+        text = " ".join((getattr(resp, "text", "") or "").split())
+        return text[:MEMORY_SUMMARY_CHARS] or fallback
     except Exception as e:
-        print("[TTS ERROR]", e)
+        mem_log.warning("summary call failed: %r", e, extra={"outcome": ModelClient._outcome(e)})
+        return fallback
+
+memory = None
+if MEMORY_DB:
+    try:
+        memory = ConversationMemory(MEMORY_DB, MEMORY_TOKEN_BUDGET)
+    except Exception as e:
+        mem_log.error("conversation memory disabled: %s", e)
 
 # =============================
 # AI call
+# =============================
+# Small-talk reply cache (opt-in)
+# =============================
+# Bump when the persona changes in a way the prompt text doesn't show
+PERSONA_VERSION = hashlib.sha1(
+    (SYSTEM_INSTRUCTION + json.dumps(FEWSHOT, ensure_ascii=False) + QUESTION_RATIO_HINT).encode("utf-8")
+).hexdigest()[:12]
+
+class ReplyCache:
+    """A few model replies per normalized small-talk opener ("hi disha", "gn").
+
+    Only conversation openers use it (see is_opener), and misses are generated
+    in a fresh FEWSHOT chat, so a cached reply carries nobody's context. A key
+    only starts serving once it holds `variants` different replies, so the
+    first few askers still get fresh model output and later ones get a random
+    pick. Entries expire after `ttl` seconds; at most `max_keys` kept.
+    """
+
+    def __init__(self, ttl: float, max_keys: int, variants: int, max_chars: int):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.variants = max(1, variants)
+        self.max_chars = max_chars
+        self._entries = OrderedDict()  # key -> (created, [replies])
+
+    def key(self, user_text: str):
+        """Cache key for a short line with no numbers or links, else None."""
+        norm = _norm_reply(user_text)
+        if not norm or len(norm) > self.max_chars or "http" in norm or any(c.isdigit() for c in norm):
+            return None
+        return (norm, PERSONA_VERSION)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] > self.ttl:
+            del self._entries[key]
+            entry = None
+        if entry is None or len(entry[1]) < self.variants:
+            C_REPLY_CACHE.inc("miss")
+            return None
+        self._entries.move_to_end(key)
+        C_REPLY_CACHE.inc("hit")
+        return random.choice(entry[1])
+
+    def add(self, key, reply: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = (time.time(), [])
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+        if len(entry[1]) < self.variants and reply not in entry[1]:
+            entry[1].append(reply)
+
+    def hit_rate(self) -> float:
+        hits, misses = C_REPLY_CACHE.values["hit"], C_REPLY_CACHE.values["miss"]
+        return hits / (hits + misses) if hits + misses else 0.0
+
+reply_cache = ReplyCache(REPLY_CACHE_TTL_SEC, REPLY_CACHE_MAX, REPLY_CACHE_VARIANTS,
+                         REPLY_CACHE_MAX_CHARS) if REPLY_CACHE else None
+
 # =============================
 def truncate_for_prompt(s: str, n: int = 600) -> str:
     s = s or ""
     return s[:n]
 
-async def generate_reply(user_id: int, user_text: str) -> str:
+async def is_opener(uid: int, st: UserState) -> bool:
+    """First words, no live chat, nothing stored: the reply can't depend on this user's context."""
+    if st.talked or st.session is not None:
+        return False
+    return memory is None or not await memory.knows(uid)
+
+async def _chat_for_reply(user_id: int, cache_key):
+    if cache_key is not None:
+        # The reply may be served to other users: no one's history in the prompt
+        return users.get(user_id), model.start_chat(history=FEWSHOT)
+    return await _chat_for(user_id)
+
+async def _keep_opener(user_id: int, user_text: str, reply: str):
+    """An opener answered from the cache or a throwaway chat still starts this user's context."""
+    st = users.get(user_id)
+    text = truncate_for_prompt(user_text)
+    if memory is not None:
+        await _remember(user_id, st, text, text, reply)
+    elif st.session is None:
+        users.set_session(st, user_id, model.start_chat(history=FEWSHOT + [
+            {"role": "user", "parts": text}, {"role": "model", "parts": reply}]))
+
+async def _chat_for(user_id: int):
+    st = users.get(user_id)
+    if shared_state and not shared_state.claim_session(user_id):
+        st.session = None  # another worker talked to this user since; our history is stale
+    if memory is not None:
+        if st.session is None:
+            history, tokens = await memory.history(user_id)
+            users.set_session(st, user_id, model.start_chat(history=history))
+            st.ctx_tokens = tokens
+    elif st.session is None or st.turns >= SESSION_MAX_TURNS:
+        users.set_session(st, user_id, model.start_chat(history=FEWSHOT))
+    return st, st.session
+
+async def _remember(user_id: int, st: UserState, prompt: str, user_text: str, reply: str):
+    if memory is None:
+        return
+    try:
+        await memory.record(user_id, user_text, reply)
+    except Exception as e:
+        mem_log.warning("record failed: %r", e, extra={"user": user_id})
+        return
+    st.ctx_tokens += estimate_tokens(prompt) + estimate_tokens(reply)
+    if st.ctx_tokens > memory.budget:
+        # Rebuild from the store next time (summary + newest turns) instead of growing
+        st.session = None
+        memory.schedule_compaction(user_id)
+
+def _repair_session(st: UserState, session):
+    """Drop the half-received turn so the chat can send again (else start over)."""
+    if session is None or st.session is not session or getattr(session, "last", None) is None:
+        return
+    try:
+        session.rewind()
+    except Exception:
+        st.session = None
+
+def _ai_fallback(e: Exception, user_id: int = None) -> str:
+    outcome = ModelClient._outcome(e)
+    C_AI_ERRORS.inc(outcome)
+    ai_log.warning("model call failed: %r", e, extra={"user": user_id, "outcome": outcome})
+    if isinstance(e, _RETRYABLE):
+        return clamp_human("Network thoda slow chal raha hai, ek sec—phir se bolo na? ")
+    return clamp_human("Kuch glitch aaya, par main yahin hoon—tum bas share karte raho. ")
+
+async def generate_reply(user_id: int, user_text: str, cache_key=None, deadline: float = None) -> str:
     if model is None:
         return clamp_human("Main yahin hoon—tu bata, mood kaisa chal raha hai. ")
-    turns = session_turns.get(user_id, 0)
-    if user_id not in chat_sessions or turns >= SESSION_MAX_TURNS:
-        chat_sessions[user_id] = model.start_chat(history=FEWSHOT)
-        session_turns[user_id] = 0
+    if cache_key is not None:
+        cached = reply_cache.get(cache_key)
+        if cached:
+            await _keep_opener(user_id, user_text, cached)
+            return cached
+    st = session = None
     try:
-        prompt = build_format_contract(truncate_for_prompt(user_text))
-        resp = await asyncio.to_thread(chat_sessions[user_id].send_message, prompt)
-        session_turns[user_id] += 1
-        raw = getattr(resp, "text", "") or ""
-        return clamp_human(raw)
+        st, session = await _chat_for_reply(user_id, cache_key)
+        text = truncate_for_prompt(user_text)
+        prompt = build_format_contract(text)
+        resp = await model_client.send(session, prompt, until=deadline)
+        if st.session is session:
+            st.turns += 1
+        reply = clamp_human(getattr(resp, "text", "") or "")
     except Exception as e:
-        print("[AI ERROR]", e)
-        return clamp_human("Kuch glitch aaya, par main yahin hoon—tum bas share karte raho. ")
+        if isinstance(e, _BROKEN_SESSION) and st is not None:
+            _repair_session(st, session)
+        return _ai_fallback(e, user_id)
+    if cache_key is not None:
+        if reply:
+            reply_cache.add(cache_key, reply)
+        await _keep_opener(user_id, user_text, reply)
+    else:
+        await _remember(user_id, st, prompt, text, reply)
+    return reply
+
+def _emit_sentence(part: str, on_sentence):
+    # A trailing emoji can split off as its own "sentence"; nothing to say there
+    if any(c.isalnum() for c in part):
+        on_sentence(part)
+
+async def generate_reply_streamed(user_id: int, user_text: str, on_sentence, cache_key=None,
+                                  deadline: float = None) -> str:
+    """Stream the reply and call on_sentence() for each finished sentence.
+
+    Sentences are cut from clamp_human() of the text received so far, so the
+    spoken lines obey the same 2-sentence/emoji limits as the final text,
+    which is clamp_human() of the whole response.
+    """
+    raw = ""
+    spoken = 0
+    cached = reply_cache.get(cache_key) if cache_key is not None and model is not None else None
+    if cached:
+        reply = cached
+        await _keep_opener(user_id, user_text, reply)
+    elif model is None:
+        reply = await generate_reply(user_id, user_text, deadline=deadline)
+    else:
+        st = session = None
+        try:
+            st, session = await _chat_for_reply(user_id, cache_key)
+            text = truncate_for_prompt(user_text)
+            prompt = build_format_contract(text)
+            async for chunk in model_client.stream(session, prompt, until=deadline):
+                raw += chunk
+                cut = SENTENCE_END_RE.split(raw)
+                if len(cut) < 2 or spoken >= 2:
+                    continue
+                complete = " ".join(cut[:-1]).strip()
+                parts = SENTENCE_END_RE.split(clamp_human(complete)) if complete else []
+                for part in parts[spoken:2]:
+                    _emit_sentence(part, on_sentence)
+                    spoken += 1
+            if st.session is session:
+                st.turns += 1
+            reply = clamp_human(raw)
+            if cache_key is not None:
+                if reply:
+                    reply_cache.add(cache_key, reply)
+                await _keep_opener(user_id, user_text, reply)
+            else:
+                await _remember(user_id, st, prompt, text, reply)
+        except Exception as e:
+            if st is not None:
+                _repair_session(st, session)  # a stream that dies mid-way leaves the chat unusable
+            if raw:
+                ai_log.warning("stream cut short: %r", e, extra={"user": user_id, "outcome": ModelClient._outcome(e)})
+                reply = clamp_human(raw)
+            else:
+                reply = _ai_fallback(e, user_id)
+    for part in SENTENCE_END_RE.split(reply)[spoken:2]:
+        _emit_sentence(part, on_sentence)
+    return reply
 
 # =============================
 # Commands
 # =============================
 async def cmd_reset(message: discord.Message, uid: int):
-    chat_sessions.pop(uid, None)
-    session_turns.pop(uid, None)
+    users.drop_session(uid)
+    if memory is not None:
+        await memory.forget(uid)
     await type_and_send(message, "Ho gaya reset—fresh start lete hain. Aaj ka din kaisa tha? ")
 
 async def cmd_hello(message: discord.Message):
@@ -440,7 +2889,7 @@ async def cmd_meme(message: discord.Message):
         "https://i.imgflip.com/30b1gx.jpg",
     ]
     await type_and_send(message, "Yeh lo ek meme—thoda smile aa jaye bas. 😄")
-    await safe_send(message.channel, random.choice(memes))
+    await safe_send(message.channel, random.choice(memes), send_priority(message))
 
 async def cmd_setvoice(message: discord.Message, preset: str):
     global VOICE_NAME, VOICE_RATE, VOICE_PITCH, VOICE_STYLE
@@ -462,32 +2911,398 @@ async def cmd_setvoice(message: discord.Message, preset: str):
         await type_and_send(message, "Voice switched to **Swara (HI-IN)**, friendly vibe.")
     else:
         await type_and_send(message, "Use: `!setvoice cute | flirty | calm | neerja | swara`")
+        return
+    if ENABLE_TTS:
+        asyncio.ensure_future(prewarm_clips(backend=backend_for(message.guild)))  # new voice -> new cache keys
+
+VOICE_MODES = {"local": "local", "fast": "local", "remote": "edge", "hd": "edge", "edge": "edge"}
+
+async def cmd_voicemode(message: discord.Message, mode: str):
+    if message.guild is None:
+        return await type_and_send(message, "Voice mode sirf server me kaam karta hai. 🙂")
+    name = VOICE_MODES.get((mode or "").strip().lower())
+    if name is None:
+        current = "local" if backend_for(message.guild).name == "local" else "remote"
+        return await type_and_send(message, f"Abhi: **{current}**. Use: `!voicemode local | remote`")
+    guild_tts[message.guild.id] = name
+    if ENABLE_TTS:
+        asyncio.ensure_future(prewarm_clips(backend=tts_backends[name]))
+    if name == "local":
+        await type_and_send(message, "Voice mode: **local** (fast, offline voice).")
+    else:
+        await type_and_send(message, "Voice mode: **remote** (natural neural voice).")
+
+LOGGER_NAMES = ("disha", "disha.ai", "disha.tts", "disha.send", "disha.memory", "discord")
+
+async def cmd_loglevel(message: discord.Message, arg: str):
+    """!loglevel [debug|info|warning|error] [ai|tts|send|memory|discord] — admins only."""
+    if message.author.id not in ADMIN_USER_IDS:
+        return
+    parts = arg.split()
+    if not parts:
+        levels = " · ".join(f"{n} {logging.getLevelName(logging.getLogger(n).getEffectiveLevel())}"
+                            for n in LOGGER_NAMES)
+        return await type_and_send(message, f"Log levels: {levels}")
+    level = parts[0].upper()
+    name = parts[1].lower() if len(parts) > 1 else ""
+    logger_name = name if name in ("disha", "discord") else (f"disha.{name}" if name else "disha")
+    if level not in ("DEBUG", "INFO", "WARNING", "ERROR") or logger_name not in LOGGER_NAMES:
+        return await type_and_send(message, "Use: `!loglevel debug|info|warning|error [ai|tts|send|memory|discord]`")
+    logging.getLogger(logger_name).setLevel(level)
+    log.warning("log level of %s set to %s", logger_name, level, extra=log_fields(message))
+    await type_and_send(message, f"`{logger_name}` → {level}")
+
+async def cmd_profile(message: discord.Message, arg: str):
+    """!profile [seconds] — admins only; replies with a collapsed-stack file."""
+    if message.author.id not in ADMIN_USER_IDS:
+        return
+    try:
+        seconds = float(arg.strip() or "10")
+    except ValueError:
+        return await type_and_send(message, "Use: `!profile [seconds]`")
+    if _PROFILE_LOCK.locked():
+        return await type_and_send(message, "Ek profile pehle se chal raha hai.")
+    await type_and_send(message, f"Profiling {min(seconds, PROFILE_MAX_SEC):g}s…")
+    folded = await run_profile(seconds)
+    note = (f"loop lag now {health_state.loop_lag * 1000:.0f} ms · blocked {watchdog.blocks}x · "
+            "open with speedscope.app or flamegraph.pl")
+    # Attachments skip the text send queue
+    try:
+        await message.channel.send(note, file=discord.File(io.BytesIO(folded.encode("utf-8")), "profile.folded"))
+    except HTTPException as e:
+        send_log.warning("profile upload failed: %s", e, extra=log_fields(message))
 
 async def cmd_who(message: discord.Message):
-    await type_and_send(message, f"Instance: `{INSTANCE_ID}`")
+    r = users.report()
+    shard = f" · shard {message.guild.shard_id}/{client.shard_count}" if SHARD_IDS and message.guild else ""
+    cache = f" · cache hit {reply_cache.hit_rate():.0%}" if reply_cache is not None else ""
+    await type_and_send(message, f"Instance: `{WORKER_ID}`{shard} · users {r['users']} · sessions {r['sessions']}"
+                                 f" · queue {admission.depth()} ({admission.running} running){cache}")
+
+# =============================
+# Reply pipeline
+# =============================
+REPLY_KEYLINE_RE = re.compile(r"(?m)^[ \t\-]*[A-Za-z0-9_.-]+:\s*[^#\n]*$")
+
+def _looks_like_code(text: str) -> bool:
+    return "```" in text or (":" in text and bool(REPLY_KEYLINE_RE.search(text)))
+
+async def respond(message: discord.Message, st: UserState, prompt_text: str, cacheable: bool = True,
+                  deadline: float = None):
+    """Generate, send and speak one reply. Caller holds the user's lock.
+
+    `deadline` (time.monotonic()) bounds the model call, retries included.
+    """
+    uid = message.author.id
+    # Only openers: a reply, a follow-up or an ongoing chat has context a shared line wouldn't fit
+    cache_key = None
+    if reply_cache is not None and cacheable and message.reference is None and await is_opener(uid, st):
+        cache_key = reply_cache.key(prompt_text)
+    name = message.author.display_name or message.author.name
+    vc = get_voice_client(message.guild)
+    streamed = STREAM_REPLIES and ENABLE_TTS and vc is not None and vc.is_connected()
+    if streamed:
+        # Voice starts on sentence 1 while the model is still writing sentence 2;
+        # both go into one queue item so no other line lands between them
+        spoken = None
+
+        def on_sentence(sentence: str):
+            nonlocal spoken
+            if _looks_like_code(sentence):
+                sentence = CODE_SUMMARY_LINE
+            if spoken is None:
+                spoken = speak_in_vc(message.guild, sentence, name, uid, more=True)
+            else:
+                spoken.add(sentence)
+
+        started = time.perf_counter()
+        try:
+            reply = await generate_reply_streamed(uid, prompt_text, on_sentence, cache_key, deadline)
+        finally:
+            if spoken is not None:
+                spoken.close()
+    else:
+        started = time.perf_counter()
+        reply = await generate_reply(uid, prompt_text, cache_key, deadline)
+    H_REPLY.since(started)
+    st.talked = True
+    log.info("reply generated", extra=log_fields(message, latency=time.perf_counter() - started))
+
+    # Don't send the exact same line twice to this user
+    nr = _norm_reply(reply)
+    if st.last_reply_norm == nr:
+        reply = TRAILING_PUNCT_RE.sub("", reply).strip() + " — theek lag raha hai, main saath hoon. 🙂"
+    st.last_reply_norm = _norm_reply(reply)
+
+    await type_and_send(message, reply)
+
+    # Speak a strictly sanitized version (won't read code/YAML)
+    if not streamed:
+        try:
+            # Optional: hard stop if reply itself looks like code
+            reply_for_tts = CODE_SUMMARY_LINE if _looks_like_code(reply) else reply
+            speak_in_vc(message.guild, reply_for_tts, name, uid)
+        except Exception as e:
+            tts_log.warning("speak failed: %r", e, extra=log_fields(message))
+
+    note_replied(st, uid)
+    mark_engaged(message, uid)  # extend the natural follow-up window
+
+class Coalescer:
+    """Buffers quick message bursts per (user, channel) and replies once per burst."""
+
+    def __init__(self):
+        self._bursts = {}  # (user_id, channel_id) -> [messages, first_at, last_at, timer task]
+
+    @staticmethod
+    def _key(message: discord.Message) -> tuple:
+        return (message.author.id, getattr(message.channel, "id", 0))
+
+    def pending(self, message: discord.Message) -> bool:
+        return self._key(message) in self._bursts
+
+    def add(self, message: discord.Message, st: UserState, priority):
+        key = self._key(message)
+        now = time.monotonic()
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = [[], now, now, None, PRIO_FOLLOWUP]
+        else:
+            gap = now - burst[2]
+            st.burst_gap = gap if not st.burst_gap else 0.5 * st.burst_gap + 0.5 * gap
+            burst[3].cancel()
+            C_COALESCE.inc("merged")
+        burst[0].append(message)
+        burst[2] = now
+        if priority is not None:
+            burst[4] = min(burst[4], priority)
+        # Wait a bit longer than this user's usual gap between messages
+        window = min(max(1.5 * st.burst_gap, COALESCE_MIN_MS / 1000), COALESCE_MAX_MS / 1000)
+        window = min(window, burst[1] + COALESCE_HOLD_MS / 1000 - now)
+        burst[3] = asyncio.ensure_future(self._flush_later(key, max(0.0, window)))
+
+    async def _flush_later(self, key: tuple, delay: float):
+        await asyncio.sleep(delay)
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return
+        C_COALESCE.inc("burst")
+        messages = burst[0]
+        message = messages[-1]
+        st = users.get(message.author.id)
+        # Nothing gets dropped here: wait out the cooldown; admission folds this
+        # into the user's waiting ticket or queues it behind the reply in progress
+        wait = cooldown_remaining(st, message.author.id)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        texts = (MENTION_RE.sub("", (m.content or "")).strip() for m in messages)
+        prompt_text = "\n".join(t for t in texts if t)
+        admission.submit(message, st, prompt_text, burst[4],
+                         cacheable=len(messages) == 1 and burst[4] == PRIO_DIRECT)
+
+coalescer = Coalescer()
+
+# =============================
+# Admission control (priority queue in front of respond)
+# =============================
+PRIO_DIRECT, PRIO_REPLY, PRIO_FOLLOWUP = 0, 1, 2
+
+SHED_REPLIES = [
+    "Abhi thoda rush hai—ek minute me phir se bolo na? 🙏",
+    "Ek sec, bahut saari baatein ek saath aa gayi—thodi der me pakka reply karti hoon.",
+    "Thoda busy ho gayi abhi, par main yahin hoon—zara ruk ke phir ping karo. 🙂",
+]
+
+async def reply_priority(message: discord.Message, asked: bool, engaged: bool):
+    """PRIO_* for a message the bot should answer, else None."""
+    if asked:
+        return PRIO_DIRECT
+    if engaged:
+        # Answered either way, so no API fetch just to rank it
+        return PRIO_REPLY if await replied_to_bot(message, fetch=False) else PRIO_FOLLOWUP
+    return PRIO_REPLY if await replied_to_bot(message) else None
+
+class Ticket:
+    """One queued reply. `deadline` covers the queue wait and the model call."""
+    __slots__ = ("message", "st", "prompt_text", "priority", "cacheable", "enqueued", "deadline", "done")
+
+    def __init__(self, message, st, prompt_text, priority, cacheable):
+        self.message = message
+        self.st = st
+        self.prompt_text = prompt_text
+        self.priority = priority
+        self.cacheable = cacheable
+        self.enqueued = time.monotonic()
+        self.deadline = self.enqueued + ADMIT_DEADLINE_SEC
+        self.done = False
+
+    def merge(self, message, prompt_text: str, priority: int):
+        """Fold a later message from the same user and channel into this ticket."""
+        self.message = message  # answer the newest one
+        self.prompt_text = "\n".join(t for t in (self.prompt_text, prompt_text) if t)
+        self.priority = min(self.priority, priority)
+        self.cacheable = False
+
+    def shed_at(self) -> float:
+        wait = max(0.0, ADMIT_DEADLINE_SEC - ADMIT_MIN_BUDGET_SEC)
+        if self.priority == PRIO_FOLLOWUP:
+            wait = min(wait, ADMIT_SHED_WAIT_SEC)
+        return self.enqueued + wait
+
+class Admission:
+    """At most `slots` replies generate at once; the rest wait by priority.
+
+    A queued ticket is shed once less than ADMIT_MIN_BUDGET_SEC of its
+    deadline is left (direct asks get a canned line instead of silence), and follow-ups are shed sooner, once
+    they have waited ADMIT_SHED_WAIT_SEC. A started ticket's model call
+    gets whatever is left of its deadline. One queued ticket per user and
+    channel: later messages are merged into it, not dropped.
+    """
+
+    def __init__(self, slots: int, queue_max: int):
+        self.slots = max(1, slots)
+        self.queue_max = max(1, queue_max)
+        self.running = 0
+        self._heap = []  # (priority, seq, Ticket); shed tickets stay until popped
+        self._seq = 0
+        self._waiting = {}  # (user_id, channel_id) -> Ticket
+
+    @staticmethod
+    def _key(message: discord.Message) -> tuple:
+        return (message.author.id, getattr(message.channel, "id", 0))
+
+    def depth(self) -> int:
+        return len(self._waiting)
+
+    def _push(self, ticket: Ticket):
+        self._seq += 1
+        heapq.heappush(self._heap, (ticket.priority, self._seq, ticket))
+
+    def submit(self, message: discord.Message, st: UserState, prompt_text: str, priority: int,
+               cacheable: bool = True) -> bool:
+        """Queue or start a reply; False if it was shed right away."""
+        key = self._key(message)
+        waiting = self._waiting.get(key)
+        if waiting is not None:
+            before = waiting.priority
+            waiting.merge(message, prompt_text, priority)
+            C_ADMIT_MERGED.inc()
+            if waiting.priority < before:
+                self._push(waiting)  # the old heap entry is skipped once this one starts
+            return True
+        ticket = Ticket(message, st, prompt_text, priority, cacheable)
+        if self.running < self.slots and not self._waiting:
+            self._start(ticket)
+            return True
+        if len(self._waiting) >= self.queue_max:
+            worst = max(self._waiting.values(), key=lambda t: (t.priority, t.enqueued))
+            if (worst.priority, worst.enqueued) <= (priority, ticket.enqueued):
+                self._shed(ticket, "queue_full")
+                return False
+            self._unqueue(worst)
+            self._shed(worst, "queue_full")
+        self._push(ticket)
+        self._waiting[key] = ticket
+        asyncio.get_running_loop().call_later(ticket.shed_at() - ticket.enqueued, self._expire, ticket)
+        return True
+
+    def _unqueue(self, ticket: Ticket):
+        ticket.done = True
+        self._waiting.pop(self._key(ticket.message), None)
+
+    def _expire(self, ticket: Ticket):
+        if ticket.done:
+            return
+        left = ticket.shed_at() - time.monotonic()
+        if left > 0:  # a merge raised its priority, so it may wait longer
+            asyncio.get_running_loop().call_later(left, self._expire, ticket)
+            return
+        self._unqueue(ticket)
+        self._shed(ticket, "deadline" if ticket.priority != PRIO_FOLLOWUP else "wait")
+
+    def _shed(self, ticket: Ticket, reason: str):
+        C_SHED.inc(reason)
+        if ticket.priority == PRIO_FOLLOWUP and ADMIT_SHED_MODE != "canned":
+            return
+        asyncio.ensure_future(type_and_send(ticket.message, random.choice(SHED_REPLIES)))
+        note_replied(ticket.st, ticket.message.author.id)
+
+    def _start(self, ticket: Ticket):
+        self.running += 1
+        H_ADMIT_WAIT.observe(time.monotonic() - ticket.enqueued)
+        asyncio.ensure_future(self._run(ticket))
+
+    async def _run(self, ticket: Ticket):
+        try:
+            async with users.lock_for(ticket.st):
+                await respond(ticket.message, ticket.st, ticket.prompt_text, ticket.cacheable,
+                              ticket.deadline)
+        except Exception:
+            log.exception("respond failed", extra=log_fields(ticket.message))
+        finally:
+            self.running -= 1
+            self._next()
+
+    def _next(self):
+        while self._heap and self.running < self.slots:
+            _, _, ticket = heapq.heappop(self._heap)
+            if ticket.done:
+                continue
+            self._unqueue(ticket)
+            if ticket.deadline - time.monotonic() < ADMIT_MIN_BUDGET_SEC:
+                # Too little left for a model call; the shed timer just hasn't fired yet
+                self._shed(ticket, "deadline" if ticket.priority != PRIO_FOLLOWUP else "wait")
+                continue
+            self._start(ticket)
+
+admission = Admission(ADMIT_CONCURRENCY, ADMIT_QUEUE_MAX)
 
 # =============================
 # Events
 # =============================
+@client.event
+async def setup_hook():
+    # Same loop as the gateway: no extra thread, and health reflects this loop.
+    # In sharded mode only worker 0 owns the public port.
+    if SHARD_WORKER == 0:
+        await keep_alive()
+    asyncio.ensure_future(loop_lag_monitor(LOOP_LAG_INTERVAL))
+    watchdog.start()
+    if ENABLE_TTS:
+        asyncio.ensure_future(prewarm_clips())
+
 @client.event
 async def on_ready():
-    print(f"[READY] Logged in as {client.user}")
+    global _SWEEPER
+    log.info("ready as %s", client.user)
+    health_state.gateway_down_since = None
+    if _SWEEPER is None or _SWEEPER.done():
+        _SWEEPER = asyncio.ensure_future(sweeper())
 
 @client.event
 async def on_disconnect():
-    print("[WARN] Disconnected. Auto-reconnect should kick in.")
+    log.warning("gateway disconnected; waiting for auto-reconnect")
+    if health_state.gateway_down_since is None:
+        health_state.gateway_down_since = time.time()
+
+@client.event
+async def on_resumed():
+    health_state.gateway_down_since = None
 
 @client.event
 async def on_error(event_method, *args, **kwargs):
-    print(f"[ERROR] on_error in {event_method}", args, kwargs)
+    message = next((a for a in args if isinstance(a, discord.Message)), None)
+    log.exception("unhandled error in %s", event_method, extra=log_fields(message))
 
 @client.event
 async def on_message(message: discord.Message):
+    health_state.last_message_at = time.time()
     if message.author.bot:
         return
 
     # One-reply-per-message guard
     if already_processed(message.id):
+        C_SKIPPED.inc("dedupe")
         return
 
     uid = message.author.id
@@ -503,15 +3318,25 @@ async def on_message(message: discord.Message):
         return await cmd_meme(message)
     if low.startswith("!who"):
         return await cmd_who(message)
+    if low.startswith("!profile"):
+        return await cmd_profile(message, content[len("!profile"):])
+    if low.startswith("!loglevel"):
+        return await cmd_loglevel(message, content[len("!loglevel"):])
     if low.startswith("!setvoice"):
         arg = content.split(" ", 1)[1] if " " in content else ""
         return await cmd_setvoice(message, arg)
+    if low.startswith("!voicemode"):
+        arg = content.split(" ", 1)[1] if " " in content else ""
+        return await cmd_voicemode(message, arg)
 
     # Voice commands
     if low.startswith("!joinvc"):
         vc = await join_user_channel(message)
         if vc:
             await type_and_send(message, "Join ho gayi—ab main VC me bolungi bhi. 😊")
+            speak_in_vc(message.guild, VOICE_ACKS["joinvc"], "")
+            names = [m.display_name for m in vc.channel.members if not m.bot]
+            asyncio.ensure_future(prewarm_clips(names, backend_for(message.guild)))
         return
     if low.startswith("!leavevc"):
         await leave_vc(message.guild)
@@ -521,58 +3346,120 @@ async def on_message(message: discord.Message):
     # When should we reply?
     is_dm = isinstance(message.channel, discord.DMChannel)
     mentioned = client.user in getattr(message, "mentions", [])
-    is_reply_to_bot = (message.reference and message.reference.resolved
-                       and message.reference.resolved.author == client.user)
     engaged_here = still_engaged(message, uid)  # <- keeps convo flowing w/o mentions
 
-    direct = is_dm or mentioned or is_reply_to_bot or engaged_here
-    if not direct:
+    priority = await reply_priority(message, is_dm or mentioned, engaged_here)
+    if priority is None and not (ENABLE_COALESCE and coalescer.pending(message)):
+        return
+
+    if ENABLE_COALESCE:
+        coalescer.add(message, users.get(uid), priority)
         return
 
     # Cooldown
-    now = time.time()
-    if now - last_reply_at.get(uid, 0) < REPLY_COOLDOWN_SEC:
+    st = users.get(uid)
+    if cooldown_remaining(st, uid) > 0:
+        C_SKIPPED.inc("cooldown")
         return
 
     # Per-user lock
-    lock = user_locks.setdefault(uid, asyncio.Lock())
+    lock = users.lock_for(st)
     if lock.locked():
+        C_SKIPPED.inc("lock")
         return
 
-    async with lock:
-        prompt_text = MENTION_RE.sub("", content).strip()
-        reply = await generate_reply(uid, prompt_text)
-
-        # Don't send the exact same line twice to this user
-        nr = _norm_reply(reply)
-        if _LAST_REPLY_NORM.get(uid) == nr:
-            reply = re.sub(r"[!? .]+$", "", reply).strip() + " — theek lag raha hai, main saath hoon. 🙂"
-        _LAST_REPLY_NORM[uid] = _norm_reply(reply)
+    admission.submit(message, st, MENTION_RE.sub("", content).strip(), priority,
+                     cacheable=priority == PRIO_DIRECT)
 
-        await type_and_send(message, reply)
-
-        # Speak a strictly sanitized version (won't read code/YAML)
+# =============================
+# Supervisor (SHARD_WORKERS > 0)
+# =============================
+IDENTIFY_GAP_SEC = 5.5  # Discord allows one IDENTIFY per 5 s per bucket
+
+def recommended_shards() -> int:
+    req = urllib.request.Request("https://discord.com/api/v10/gateway/bot",
+                                 headers={"Authorization": f"Bot {BOT_TOKEN}", "User-Agent": "DishaBot"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return int(json.load(resp)["shards"])
+
+def run_supervisor(workers: int):
+    """Start one process per shard slice and restart any that die."""
+    total = SHARD_COUNT
+    if total <= 0:
         try:
-            # Optional: hard stop if reply itself looks like code
-            reply_for_tts = reply
-            if "```" in reply or re.search(r"(?m)^[ \t\-]*[A-Za-z0-9_.-]+:\s*[^#\n]*$", reply):
-                reply_for_tts = CODE_SUMMARY_LINE
-            await speak_in_vc(message.guild, reply_for_tts, message.author.display_name or message.author.name)
+            total = recommended_shards()
         except Exception as e:
-            print("[VC TTS WARN]", e)
-
-        last_reply_at[uid] = time.time()
-        mark_engaged(message, uid)  # extend the natural follow-up window
+            log.warning("recommended shard count unavailable: %s", e)
+            total = workers
+    total = -(-max(total, workers) // workers) * workers  # round up to a multiple of workers
+    db = SHARED_STATE_DB or os.path.join(tempfile.gettempdir(), "disha-shared.db")
+    slices = [list(range(i, total, workers)) for i in range(workers)]
+    log.info("%d workers x %d shards, shared state %s, model quota %.3g rpm per worker",
+             workers, total // workers, db, MODEL_RPM / workers)
+
+    # One API key for all workers: split its quota instead of multiplying it
+    quota = {"MODEL_RPM": str(MODEL_RPM / workers),
+             "MODEL_BURST": str(max(1, MODEL_BURST // workers)),
+             "MODEL_MAX_CONCURRENCY": str(max(1, MODEL_MAX_CONCURRENCY // workers)),
+             "TTS_CACHE_MAX_MB": str(TTS_CACHE_MAX_MB / workers),
+             "OPUS_CACHE_MAX_MB": str(OPUS_CACHE_MAX_MB / workers),
+             "LOCAL_TTS_CACHE_MAX_MB": str(LOCAL_TTS_CACHE_MAX_MB / workers),
+             "TTS_CACHE_MAX_ENTRIES": str(max(1, TTS_CACHE_MAX_ENTRIES // workers))}
+
+    def spawn(i: int) -> subprocess.Popen:
+        # Own cache dir: a worker's startup sweep of *.tmp must not hit another's
+        # in-flight writes, and one LRU index per set of files keeps the budget real
+        env = dict(os.environ, SHARD_WORKERS="0", SHARD_COUNT=str(total), SHARD_WORKER=str(i),
+                   SHARD_IDS=",".join(map(str, slices[i])), SHARED_STATE_DB=db,
+                   TTS_CACHE_DIR=os.path.join(TTS_CACHE_DIR, f"worker-{i}"), **quota)
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    procs = []
+    for i in range(workers):
+        procs.append(spawn(i))
+        if i < workers - 1:
+            time.sleep(IDENTIFY_GAP_SEC * len(slices[i]))  # stagger logins
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for p in procs:
+            p.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    restarts = [0] * workers
+    restart_at = [None] * workers
+    while not stopping:
+        time.sleep(1)
+        now = time.time()
+        for i, p in enumerate(procs):
+            if restart_at[i] is not None:
+                if now >= restart_at[i] and not stopping:
+                    procs[i] = spawn(i)
+                    restart_at[i] = None
+                continue
+            code = p.poll()
+            if code is not None and not stopping:
+                restarts[i] += 1
+                delay = min(60, 2 ** restarts[i])
+                log.warning("worker %d exited (%s); restarting in %ds", i, code, delay)
+                restart_at[i] = now + delay
+    for p in procs:
+        p.wait()
 
 # =============================
 # Boot
 # =============================
 if __name__ == "__main__":
     if not BOT_TOKEN:
-        print("[SETUP] BOT_TOKEN missing in Secrets")
+        log.error("BOT_TOKEN missing in Secrets")
+    elif SHARD_WORKERS > 0:
+        run_supervisor(SHARD_WORKERS)
     else:
-        keep_alive()
         try:
-            client.run(BOT_TOKEN)
-        except Exception as e:
-            print("[ERROR]", e)
+            client.run(BOT_TOKEN, log_handler=None)  # discord.py logs go through our queue
+        except Exception:
+            log.exception("client stopped")